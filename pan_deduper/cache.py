@@ -0,0 +1,246 @@
+"""pan_deduper.cache"""
+import hashlib
+import json
+import logging
+import marshal
+import os
+import re
+import shutil
+import sys
+import time
+from typing import Any, Tuple, Union
+
+logger = logging.getLogger("utils")
+
+MISS = object()  # Cached values can be None, so a miss is its own thing
+
+
+def slugify(value: str) -> str:
+    """
+    Make a string safe to use as a directory name
+
+    Args:
+        value: string
+
+    Returns:
+        filesystem friendly string
+    """
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", value)
+
+
+class DiskCache:
+    """
+    Files under one cache directory, least recently used evicted first
+
+    Files are evicted once the whole directory is over max_mb. Each cache gets its own directory (and so its own max_mb), one cache filling up
+    never evicts another's files.
+    """
+
+    def __init__(self, directory: str, max_mb: int):
+        """
+        Initialize the cache
+
+        Args:
+            directory: directory of this cache (nothing else in it)
+            max_mb: maximum size of the directory in MB
+        """
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.size = sum(size for _, size, _ in self._files())
+
+    def _files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _write(self, filename: str, data: bytes) -> None:
+        try:
+            old_size = os.path.getsize(filename)
+        except OSError:
+            old_size = 0
+        try:
+            with open(filename, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            logger.error(f"Unable to write to cache {filename}: {e}")
+            return
+
+        self.size += len(data) - old_size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def _read(self, filename: str) -> Union[None, bytes]:
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        os.utime(filename)  # Recently used, evict it last
+        return data
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in max_mb"""
+        files = sorted(self._files(), key=lambda file: file[2])
+        self.size = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+
+class ResponseCache(DiskCache):
+    """
+    On-disk cache of Panorama API responses
+
+    Layout is <directory>/responses/<panorama>/<config version>/<hash of key>.json.
+    Opening the cache for a new config version deletes the old versions for that
+    Panorama.
+    """
+
+    def __init__(self, directory: str, panorama: str, version: str, max_mb: int):
+        """
+        Initialize (and clean up) the cache
+
+        Args:
+            directory: cache root directory
+            panorama: Panorama IP/FQDN
+            version: config version marker, anything cached under another version is stale
+            max_mb: maximum size of all cached responses in MB
+        """
+        responses_dir = os.path.join(directory, "responses")
+        panorama_dir = os.path.join(responses_dir, slugify(panorama))
+        self.path = os.path.join(panorama_dir, slugify(version))
+        os.makedirs(self.path, exist_ok=True)
+
+        # Anything from an older config version is stale
+        for entry in os.scandir(panorama_dir):
+            if entry.is_dir() and entry.path != self.path:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+        super().__init__(responses_dir, max_mb)
+
+    def _filename(self, key: Tuple) -> str:
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf8"))
+        return os.path.join(self.path, f"{digest.hexdigest()}.json")
+
+    def get(self, key: Tuple) -> Any:
+        """
+        Get a cached value
+
+        Args:
+            key: anything json serializable
+
+        Returns:
+            cached value, or MISS
+        """
+        data = self._read(self._filename(key))
+        if data is None:
+            return MISS
+        try:
+            return json.loads(data)
+        except ValueError:
+            return MISS
+
+    def set(self, key: Tuple, value: Any) -> None:
+        """
+        Cache a value
+
+        Args:
+            key: anything json serializable
+            value: anything json serializable
+        """
+        self._write(self._filename(key), json.dumps(value).encode("utf8"))
+
+
+class SnapshotCache(DiskCache):
+    """
+    Objects extracted from xml config files, so the same file isn't parsed twice
+
+    Snapshots are keyed by the config file's content hash and stored with marshal
+    (compact and quick to load, but tied to the python version, so that's part of
+    the filename too). Snapshots are kept in <directory>/snapshots, snapshots older
+    than max_age_days are removed on open.
+    """
+
+    def __init__(self, directory: str, max_mb: int, max_age_days: float):
+        """
+        Initialize (and clean up) the cache
+
+        Args:
+            directory: cache root directory
+            max_mb: maximum size of all snapshots in MB
+            max_age_days: snapshots not used for this long are stale
+        """
+        self.path = os.path.join(directory, "snapshots")
+        os.makedirs(self.path, exist_ok=True)
+
+        oldest = time.time() - max_age_days * 86400
+        for entry in os.scandir(self.path):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < oldest:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+        super().__init__(self.path, max_mb)
+
+    def _filename(self, digest: str, kind: str) -> str:
+        python = f"py{sys.version_info[0]}{sys.version_info[1]}"
+        return os.path.join(self.path, f"{digest}-{slugify(kind)}-{python}.marshal")
+
+    def get(self, digest: str, kind: str) -> Any:
+        """
+        Get a snapshot
+
+        Args:
+            digest: config file content hash
+            kind: what was extracted (e.g. names/deep)
+
+        Returns:
+            snapshot, or MISS
+        """
+        data = self._read(self._filename(digest, kind))
+        if data is None:
+            return MISS
+        try:
+            return marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return MISS
+
+    def set(self, digest: str, kind: str, snapshot: Any) -> None:
+        """
+        Save a snapshot
+
+        Args:
+            digest: config file content hash
+            kind: what was extracted (e.g. names/deep)
+            snapshot: dicts/lists/sets of plain values
+        """
+        self._write(self._filename(digest, kind), marshal.dumps(snapshot))
+
+
+def file_digest(filename: str) -> str:
+    """
+    Content hash of a file
+
+    Args:
+        filename: filename
+
+    Returns:
+        hex digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,7 +1,6 @@
 """pan_deduper.cli"""
 import asyncio
 import platform
-import sys
 from typing import Optional
 
 import typer
@@ -33,25 +32,24 @@ def xml(
         "-d",
         metavar="Perform deeper search on values (not just names)",
     ),
+    explain: bool = typer.Option(
+        None,
+        "--explain",
+        "-e",
+        metavar="Include field-level differences in the deep search output",
+    ),
 ) -> None:
     """
     Command Line Entry via XML
 
     Args:
-        filename: filename.xml
+        filename: filename.xml (or .xml.gz/.bz2/.xz, or a .tgz bundle)
         deep: deep search into values as well
+        explain: explain the differences found by deep search
     """
     print("\n\tXML Time!\n")
 
-    try:
-        with open(filename, encoding="utf8") as f:
-            configstr = f.read()
-    except OSError as e:
-        print(e)
-        print("\nFile open failed...typo?\n")
-        sys.exit(1)
-
-    asyncio.run(run_deduper(configstr=configstr, deep=deep))
+    asyncio.run(run_deduper(configfile=filename, deep=deep, explain=explain))
 
 
 @app.command("panorama", help="Gather objects/services via Panorama")
@@ -80,6 +78,18 @@ def panorama(
         "-d",
         metavar="Perform deeper search on values (not just names)",
     ),
+    explain: bool = typer.Option(
+        None,
+        "--explain",
+        "-e",
+        metavar="Include field-level differences in the deep search output",
+    ),
+    bulk: bool = typer.Option(
+        None,
+        "--bulk",
+        "-b",
+        metavar="Pull the full candidate config in one request (faster on large Panoramas)",
+    ),
 ) -> None:
     """
     Command Line Entry via Panorama
@@ -89,11 +99,18 @@ def panorama(
         username:
         password:
         deep: deep search into values as well
+        explain: explain the differences found by deep search
+        bulk: get the whole config at once instead of per object type/device group
     """
     print("\n\tPanorama Time!\n")
     asyncio.run(
         run_deduper(
-            panorama=panorama_ip, username=username, password=password, deep=deep
+            panorama=panorama_ip,
+            username=username,
+            password=password,
+            deep=deep,
+            explain=explain,
+            bulk=bulk,
         )
     )
 
@@ -0,0 +1,584 @@
+"""
+pan_deduper.mock_panorama
+
+A fake Panorama (httpx transport) for benchmarking/testing PanoramaApi offline.
+
+    pan = PanoramaApi(panorama="mock", username="admin", password="admin",
+                      transport=MockPanorama(device_groups=1000, objects=50))
+
+Or benchmark a full fetch + push from the command line:
+
+    python -m pan_deduper.mock_panorama --device-groups 1000 --objects 50 --latency 0.05
+"""
+import asyncio
+import json
+import random
+import time
+from copy import deepcopy
+from typing import Dict, List, Tuple, Union
+from urllib.parse import parse_qs
+
+import httpx
+import xmltodict
+from lxml import etree
+
+API_KEY = "MOCKAPIKEY=="
+
+# REST endpoint -> (object type, xml element name)
+REST_OBJECTS = {
+    "Objects/Addresses": ("addresses", "address"),
+    "Objects/AddressGroups": ("address-groups", "address-group"),
+    "Objects/Services": ("services", "service"),
+    "Objects/ServiceGroups": ("service-groups", "service-group"),
+    "Objects/Tags": ("tags", "tag"),
+}
+REST_RULES = {
+    "Policies/SecurityPreRules": "pre-rulebase",
+    "Policies/SecurityPostRules": "post-rulebase",
+}
+NAME_PREFIX = {
+    "addresses": "addr",
+    "address-groups": "addr-grp",
+    "services": "svc",
+    "service-groups": "svc-grp",
+    "tags": "tag",
+}
+INTERNAL_ERROR_JSON = {"@status": "error", "@code": "1", "message": "Internal Error"}
+INTERNAL_ERROR_XML = (
+    '<response status="error"><msg><line>Internal Error</line></msg></response>'
+)
+
+
+class MockPanorama(httpx.MockTransport):
+    """
+    Synthetic Panorama for benchmarking/testing PanoramaApi offline
+
+    Answers the XML API (/api/) and the REST API endpoints PanoramaApi uses. Every
+    device group gets the same number of each object type, the first
+    'duplicate_ratio' of them use the same name (and value) in every device group so
+    there's always something to dedupe. Data is generated on request, so large
+    sizes don't need the memory up front. Writes are acknowledged and counted,
+    not applied.
+    """
+
+    def __init__(
+        self,
+        device_groups: int = 10,
+        objects: int = 100,
+        rules: int = 20,
+        shared_objects: int = 10,
+        duplicate_ratio: float = 0.5,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        latency_per_entry: float = 0.0,
+        capacity: int = 0,
+        error_rate: float = 0.0,
+        seed: int = None,
+    ) -> None:
+        """
+        Initialize the mock
+
+        Args:
+            device_groups: number of device groups
+            objects: objects of each type in each device group
+            rules: security rules in each pre/post rulebase of each device group
+            shared_objects: objects of each type in shared
+            duplicate_ratio: share of each device group's objects duplicated in all of them
+            latency: seconds added to every response
+            jitter: up to this many random seconds added on top
+            latency_per_entry: seconds added per object/rule returned or changed
+            capacity: concurrent requests handled at full speed, responses slow down
+                proportionally past it (0 for unlimited)
+            error_rate: share of requests (other than login) answered with 'Internal Error'
+            seed: random seed, for repeatable error injection
+        """
+        super().__init__(self.handle)
+        self.device_groups = [f"dg-{i:04d}" for i in range(device_groups)]
+        self.objects = objects
+        self.rules = rules
+        self.shared_objects = shared_objects
+        self.duplicates = int(objects * duplicate_ratio)
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_per_entry = latency_per_entry
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.in_flight = 0
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "max_in_flight": 0,
+            "entries_returned": 0,
+            "entries_changed": 0,
+        }
+        self._config = None
+
+    def name(self, object_type: str, device_group: str, i: int) -> str:
+        """
+        Name of the i'th object of a type in a device group
+
+        Args:
+            object_type: addresses/address-groups/services/service-groups/tags
+            device_group: device group (or 'shared')
+            i: index
+
+        Returns:
+            object name
+        """
+        prefix = NAME_PREFIX[object_type]
+        if device_group == "shared" or i < self.duplicates:
+            return f"{prefix}-{i}"
+        return f"{prefix}-{device_group}-{i}"
+
+    def count(self, device_group: str) -> int:
+        """Objects of each type in this location"""
+        return self.shared_objects if device_group == "shared" else self.objects
+
+    def make_object(self, object_type: str, device_group: str, i: int) -> Dict:
+        """
+        Build one object, as the REST API would return it
+
+        Args:
+            object_type: addresses/address-groups/services/service-groups/tags
+            device_group: device group (or 'shared')
+            i: index
+
+        Returns:
+            object dict
+        """
+        count = self.count(device_group)
+        obj = {"@name": self.name(object_type, device_group, i)}
+        if device_group == "shared":
+            obj.update({"@location": "shared", "@loc": "shared"})
+        else:
+            obj.update(
+                {
+                    "@location": "device-group",
+                    "@device-group": device_group,
+                    "@loc": device_group,
+                }
+            )
+
+        if object_type == "addresses":
+            obj["ip-netmask"] = f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}/32"
+            if i % 10 == 0:
+                obj["tag"] = {"member": [self.name("tags", device_group, 0)]}
+        elif object_type == "address-groups":
+            members = {
+                self.name("addresses", device_group, j % count) for j in (i, i + 1)
+            }
+            obj["static"] = {"member": sorted(members)}
+        elif object_type == "services":
+            obj["protocol"] = {"tcp": {"port": str(1024 + i % 60000)}}
+        elif object_type == "service-groups":
+            members = {
+                self.name("services", device_group, j % count) for j in (i, i + 1)
+            }
+            obj["members"] = {"member": sorted(members)}
+        elif object_type == "tags":
+            obj["color"] = f"color{i % 16 + 1}"
+        return obj
+
+    def make_objects(self, object_type: str, device_group: str) -> List[Dict]:
+        """All objects of a type in a location"""
+        return [
+            self.make_object(object_type, device_group, i)
+            for i in range(self.count(device_group))
+        ]
+
+    def make_rules(self, device_group: str, rulebase: str) -> List[Dict]:
+        """
+        Security rules of a device group rulebase
+
+        Args:
+            device_group: device group
+            rulebase: pre-rulebase/post-rulebase
+
+        Returns:
+            list of rule dicts
+        """
+        rules = []
+        for i in range(self.rules):
+            rules.append(
+                {
+                    "@name": f"{rulebase.split('-')[0]}-rule-{i}",
+                    "@location": "device-group",
+                    "@device-group": device_group,
+                    "@loc": device_group,
+                    "from": {"member": ["any"]},
+                    "to": {"member": ["any"]},
+                    "source": {
+                        "member": [
+                            self.name("addresses", device_group, i % self.objects)
+                        ]
+                    },
+                    "destination": {"member": ["any"]},
+                    "service": {
+                        "member": [
+                            self.name("services", device_group, i % self.objects)
+                        ]
+                    },
+                    "application": {"member": ["any"]},
+                    "action": "allow" if i % 5 else "deny",
+                }
+            )
+        return rules
+
+    @staticmethod
+    def to_entries(parent: etree._Element, objs: List[Dict]) -> None:
+        """Append objects to an xml element as <entry>'s"""
+        for obj in objs:
+            obj = {
+                k: v for k, v in obj.items() if k not in ("@location", "@device-group")
+            }
+            parent.append(
+                etree.fromstring(xmltodict.unparse({"entry": obj}, full_document=False))
+            )
+
+    @property
+    def config(self) -> etree._Element:
+        """The whole config as xml (built once, on first use)"""
+        if self._config is not None:
+            return self._config
+
+        config = etree.Element("config")
+        shared = etree.SubElement(config, "shared")
+        for object_type, tag in REST_OBJECTS.values():
+            self.to_entries(
+                etree.SubElement(shared, tag), self.make_objects(object_type, "shared")
+            )
+
+        devices = etree.SubElement(config, "devices")
+        localhost = etree.SubElement(devices, "entry", name="localhost.localdomain")
+        dgs = etree.SubElement(localhost, "device-group")
+        for device_group in self.device_groups:
+            dg = etree.SubElement(dgs, "entry", name=device_group)
+            for object_type, tag in REST_OBJECTS.values():
+                self.to_entries(
+                    etree.SubElement(dg, tag),
+                    self.make_objects(object_type, device_group),
+                )
+            for rulebase in REST_RULES.values():
+                rules = etree.SubElement(
+                    etree.SubElement(etree.SubElement(dg, rulebase), "security"),
+                    "rules",
+                )
+                self.to_entries(rules, self.make_rules(device_group, rulebase))
+
+        readonly = etree.SubElement(
+            etree.SubElement(etree.SubElement(config, "readonly"), "devices"),
+            "entry",
+            name="localhost.localdomain",
+        )
+        readonly_dgs = etree.SubElement(readonly, "device-group")
+        for device_group in self.device_groups:
+            etree.SubElement(readonly_dgs, "entry", name=device_group)
+
+        self._config = config
+        return config
+
+    async def delay(self, entries: int) -> None:
+        """Simulate processing time"""
+        delay = self.latency + self.latency_per_entry * entries
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        if self.capacity and self.in_flight > self.capacity:
+            delay *= self.in_flight / self.capacity
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        """
+        Answer a request
+
+        Args:
+            request: httpx request
+
+        Returns:
+            httpx response
+        """
+        self.stats["requests"] += 1
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        try:
+            keygen = request.url.params.get("type") == "keygen"
+            if (
+                self.error_rate
+                and not keygen
+                and self.random.random() < self.error_rate
+            ):
+                self.stats["errors"] += 1
+                await self.delay(0)
+                if request.url.path.startswith("/restapi/"):
+                    return httpx.Response(200, json=INTERNAL_ERROR_JSON)
+                return httpx.Response(200, text=INTERNAL_ERROR_XML)
+
+            if request.url.path.startswith("/restapi/"):
+                response, entries = self.rest(request)
+            else:
+                response, entries = self.xml_api(request)
+            await self.delay(entries)
+            return response
+        finally:
+            self.in_flight -= 1
+
+    def rest(self, request: httpx.Request) -> Tuple[httpx.Response, int]:
+        """REST API, returns (response, number of entries involved)"""
+        if request.headers.get("X-PAN-KEY") != API_KEY:
+            return httpx.Response(403, json={"@status": "error", "@code": "16"}), 0
+
+        endpoint = request.url.path.split("/", 3)[-1]
+        params = request.url.params
+        location = params.get("location")
+        device_group = (
+            "shared" if location == "shared" else params.get("device-group", "")
+        )
+
+        if request.method in ("POST", "PUT", "DELETE"):
+            self.stats["entries_changed"] += 1
+            return (
+                httpx.Response(
+                    200,
+                    json={
+                        "@status": "success",
+                        "@code": "20",
+                        "msg": "command succeeded",
+                    },
+                ),
+                1,
+            )
+
+        if endpoint == "Panorama/DeviceGroups":
+            entries = [{"@name": name} for name in self.device_groups]
+        elif device_group != "shared" and device_group not in self.device_groups:
+            return (
+                httpx.Response(
+                    200,
+                    json={
+                        "@status": "error",
+                        "@code": "3",
+                        "message": "Invalid Query Parameter: device-group",
+                    },
+                ),
+                0,
+            )
+        elif endpoint in REST_OBJECTS:
+            entries = self.make_objects(REST_OBJECTS[endpoint][0], device_group)
+        elif endpoint in REST_RULES:
+            if device_group == "shared":
+                entries = []
+            else:
+                entries = self.make_rules(device_group, REST_RULES[endpoint])
+        else:
+            return httpx.Response(404, json={"@status": "error", "@code": "404"}), 0
+
+        self.stats["entries_returned"] += len(entries)
+        result = {"@total-count": str(len(entries)), "@count": str(len(entries))}
+        if entries:
+            result["entry"] = entries
+        body = {"@status": "success", "@code": "19", "result": result}
+        return httpx.Response(200, content=json.dumps(body).encode()), len(entries)
+
+    def xml_api(self, request: httpx.Request) -> Tuple[httpx.Response, int]:
+        """XML API, returns (response, number of entries involved)"""
+        params = {k: v[-1] for k, v in parse_qs(request.content.decode()).items()}
+        params.update(request.url.params)
+
+        if params.get("type") == "keygen":
+            if not params.get("user") or not params.get("password"):
+                return self.xml_error("Invalid credentials."), 0
+            return (
+                self.xml_response(
+                    f"<response status='success'><result><key>{API_KEY}</key></result></response>"
+                ),
+                0,
+            )
+
+        if API_KEY not in (params.get("key"), request.headers.get("X-PAN-KEY")):
+            response = self.xml_error("Invalid Credential")
+            response.status_code = 403
+            return response, 0
+
+        if params.get("type") == "op":
+            return self.xml_op(params.get("cmd", "")), 0
+
+        action = params.get("action")
+        if params.get("type") != "config" or action is None:
+            return self.xml_error("Unsupported request"), 0
+
+        if action in ("get", "show"):
+            try:
+                found = self.config.getroottree().xpath(params.get("xpath", ""))
+            except etree.XPathEvalError:
+                return self.xml_error("Invalid xpath"), 0
+            response = etree.Element("response", status="success")
+            result = etree.SubElement(response, "result")
+            entries = 0
+            for element in found:
+                result.append(deepcopy(element))  # Don't move it out of the config
+                entries += len(element)
+            self.stats["entries_returned"] += entries
+            return self.xml_response(etree.tostring(response)), entries
+
+        if action == "multi-config":
+            try:
+                request_xml = etree.fromstring(params.get("element", ""))
+            except etree.XMLSyntaxError:
+                return self.xml_error("Malformed multi-config request"), 0
+            response = etree.Element("response", status="success")
+            for sub in request_xml:
+                etree.SubElement(
+                    response, "response", id=sub.get("id", ""), status="success"
+                )
+            self.stats["entries_changed"] += len(request_xml)
+            return self.xml_response(etree.tostring(response)), len(request_xml)
+
+        if action in ("set", "edit", "delete"):
+            self.stats["entries_changed"] += 1
+            return (
+                self.xml_response(
+                    "<response status='success' code='20'><msg>command succeeded</msg></response>"
+                ),
+                1,
+            )
+
+        return self.xml_error(f"Unsupported action: {action}"), 0
+
+    def xml_op(self, cmd: str) -> httpx.Response:
+        """Operational commands used by PanoramaApi"""
+        if "pending-changes" in cmd:
+            return self.xml_response(
+                "<response status='success'><result>no</result></response>"
+            )
+        if "<jobs>" in cmd:
+            return self.xml_response(
+                "<response status='success'><result><job><id>1</id>"
+                "<type>CommitAll</type><status>FIN</status></job></result></response>"
+            )
+        return self.xml_error("Unsupported op command")
+
+    @staticmethod
+    def xml_response(text: Union[str, bytes]) -> httpx.Response:
+        """XML response"""
+        return httpx.Response(
+            200, content=text, headers={"Content-Type": "application/xml"}
+        )
+
+    def xml_error(self, message: str) -> httpx.Response:
+        """XML error response"""
+        return self.xml_response(
+            f"<response status='error'><msg><line>{message}</line></msg></response>"
+        )
+
+
+async def benchmark(
+    mock: MockPanorama, object_types: List[str], batch_size: int, max_concurrent: int
+) -> Dict:
+    """
+    Time a full fetch (every object type in every device group) and a batched push
+
+    Args:
+        mock: MockPanorama
+        object_types: object types to fetch
+        batch_size: objects per create/delete request
+        max_concurrent: PanoramaApi max_concurrent
+
+    Returns:
+        Dict of timings/counts
+    """
+    from pan_deduper.panorama_api import PanoramaApi
+
+    results = {}
+    async with PanoramaApi(
+        panorama="mock.panorama",
+        username="admin",
+        password="admin",
+        max_concurrent=max_concurrent,
+        transport=mock,
+    ) as pan:
+        await pan.login()
+
+        start = time.monotonic()
+        device_groups = await pan.get_device_groups()
+        fetches = [
+            pan.get_objects(object_type=object_type, device_group=device_group)
+            for object_type in object_types
+            for device_group in device_groups
+        ]
+        fetched = await asyncio.gather(*fetches)
+        results["fetch_seconds"] = time.monotonic() - start
+        results["fetch_requests"] = len(fetches)
+        results["objects_fetched"] = sum(len(objs or []) for objs in fetched)
+
+        start = time.monotonic()
+        config = await pan.get_config()
+        results["config_seconds"] = time.monotonic() - start
+        results["config_entries"] = len(config.xpath("//entry"))
+
+        objs = [mock.make_object("addresses", "shared", i) for i in range(mock.objects)]
+        start = time.monotonic()
+        await pan.create_objects(
+            object_type="addresses",
+            objs=objs,
+            device_group=["All-Devices"],
+            batch_size=batch_size,
+        )
+        deletes = [
+            ("addresses", device_group, mock.name("addresses", device_group, i))
+            for device_group in device_groups
+            for i in range(mock.duplicates)
+        ]
+        await pan.delete_objects(deletes=deletes, batch_size=batch_size)
+        results["push_seconds"] = time.monotonic() - start
+        results["objects_pushed"] = len(objs) + len(deletes)
+        results["final_concurrency_limit"] = round(pan.limiter.limit, 1)
+
+    results.update(mock.stats)
+    return results
+
+
+def main(
+    device_groups: int = 100,
+    objects: int = 100,
+    rules: int = 20,
+    latency: float = 0.05,
+    jitter: float = 0.01,
+    latency_per_entry: float = 0.00001,
+    capacity: int = 10,
+    error_rate: float = 0.0,
+    batch_size: int = 200,
+    max_concurrent: int = 10,
+    seed: int = 1,
+) -> None:
+    """Benchmark PanoramaApi against a mock Panorama"""
+    mock = MockPanorama(
+        device_groups=device_groups,
+        objects=objects,
+        rules=rules,
+        latency=latency,
+        jitter=jitter,
+        latency_per_entry=latency_per_entry,
+        capacity=capacity,
+        error_rate=error_rate,
+        seed=seed,
+    )
+    object_types = list(NAME_PREFIX)
+    results = asyncio.run(
+        benchmark(
+            mock,
+            object_types=object_types,
+            batch_size=batch_size,
+            max_concurrent=max_concurrent,
+        )
+    )
+    for key, value in results.items():
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        print(f"{key:>24}: {value}")
+
+
+if __name__ == "__main__":
+    import typer
+
+    typer.run(main)
@@ -1,38 +1,263 @@
 """pan_deduper.panorama_api"""
+import asyncio
 import logging
+import random
 import sys
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Set, Tuple, Union
 
 import httpx
+import xmltodict
 from lxml import etree
 
+from pan_deduper.cache import MISS, ResponseCache
+
 API_VERSION = "v10.1"
 logger = logging.getLogger("utils")
 
+try:
+    import h2  # pylint: disable=unused-import
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Full configs can be bigger than lxml's default safety limits
+HUGE_PARSER = etree.XMLParser(huge_tree=True)
+
+# Keys the API gives us that can't be sent back when creating an object
+REMOVE_KEYS = ["@location", "@device-group", "@loc", "@overrides"]
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter shared by every request to Panorama
+
+    Starts at `maximum` (MAX_CONCURRENT). Each healthy response adds 1/limit (so
+    about one slot per round of requests) up to `maximum`. An error, 429/5xx or
+    timeout halves the limit, once per congestion event: requests sent before the
+    last cut don't cut it again. Requests wait for a free slot under the current
+    limit.
+
+    Response times aren't used, a big get_objects response is slow because it's big
+    (not because Panorama is struggling).
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        """
+        Initialize the limiter
+
+        Args:
+            maximum: most concurrent requests allowed (MAX_CONCURRENT)
+            minimum: fewest concurrent requests allowed
+        """
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self.epoch = 0  # Number of cuts so far
+        self._condition = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        """
+        Condition requests wait on for a free slot
+
+        Created on first use, so it belongs to the running event loop.
+
+        Returns:
+            asyncio condition
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self) -> int:
+        """
+        Wait for a free slot
+
+        Returns:
+            epoch the request was sent in (give it back to release)
+        """
+        async with self.condition:
+            while self.in_flight >= int(self.limit):
+                await self.condition.wait()
+            self.in_flight += 1
+            return self.epoch
+
+    async def release(self, healthy: bool, epoch: int = None) -> None:
+        """
+        Give back a slot and adjust the limit
+
+        Args:
+            healthy: request succeeded (not an error/429/5xx/timeout)
+            epoch: what acquire returned (None to always count a failure)
+        """
+        if healthy:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        elif epoch is None or epoch == self.epoch:
+            # 1st failure of this congestion event, anything still in flight that
+            # was sent before this cut is part of the same event
+            self.epoch += 1
+            self.limit = max(self.minimum, self.limit / 2)
+            logger.info(f"Backing off, concurrent requests now {int(self.limit)}.")
+
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+def is_transient(response: httpx.Response) -> bool:
+    """
+    Is this a response that's worth retrying (Panorama was just too busy)?
+
+    Args:
+        response: httpx response
+
+    Returns:
+        True if it should be retried
+    """
+    if response.status_code >= 500 or response.status_code == 429:
+        return True
+    # Busy Panorama answers 200 with an error body, only look at small responses
+    return len(response.content) < 4096 and b"Internal Error" in response.content
+
+
+def response_message(xml: etree._Element) -> str:
+    """
+    Pull the (error) message out of an XML API response
+
+    Args:
+        xml: <response> element
+
+    Returns:
+        message text
+    """
+    lines = [text.strip() for text in xml.xpath(".//msg//text()") if text.strip()]
+    return " ".join(lines) or xml.get("status", "")
+
+
+def xpath_literal(name: str) -> str:
+    """
+    Quote a name for use in an xpath, 'name' (or "name" if it contains a ')
+
+    Args:
+        name: object/device group name
+
+    Returns:
+        quoted name
+
+    Raises:
+        ValueError: name contains both ' and ", which xpath can't quote
+    """
+    if "'" not in name:
+        return f"'{name}'"
+    if '"' not in name:
+        return f'"{name}"'
+    raise ValueError(f"Unable to quote {name!r} for an xpath.")
+
 
 class PanoramaApi:
     """Panorama api"""
 
-    def __init__(self, panorama: str, username: str, password: str) -> None:
+    def __init__(
+        self,
+        panorama: str,
+        username: str,
+        password: str,
+        max_concurrent: int = 10,
+        retries: int = 5,
+        http2: bool = False,
+        cache_dir: str = None,
+        cache_max_mb: int = 500,
+        transport: httpx.AsyncBaseTransport = None,
+    ) -> None:
         """
         Initialize Panorama API Object
 
+        Use as an async context manager (or call close()) so the connection pool is
+        shut down cleanly.
+
         Args:
             panorama: Panorama IP/FQDN
             username: username
             password: password
+            max_concurrent: most concurrent requests allowed
+            retries: retries for requests failing with Internal Error/5xx/timeouts
+            http2: use HTTP/2 (needs the 'h2' package, pip install httpx[http2])
+            cache_dir: cache get_objects responses here (None to disable the cache)
+            cache_max_mb: maximum size of the response cache
+            transport: custom httpx transport (e.g. mock_panorama.MockPanorama)
+
         Returns:
             N/A
+
         Raises:
             N/A
         """
-        self.session: Dict[str, Any] = {}
+        self.client: Union[None, httpx.AsyncClient] = None
+        self.http2 = http2
         self.panorama = panorama
         self.username = username
         self.password = password
         self.base_url = f"https://{panorama}/restapi/{API_VERSION}/"
         self.apikey = ""
         self.login_data = {}
+        self.limiter = AdaptiveLimiter(maximum=max_concurrent)
+        self.retries = retries
+        self.cache_dir = cache_dir
+        self.cache_max_mb = cache_max_mb
+        self.cache: Union[None, ResponseCache] = None
+        self.transport = transport
+        self.existing = {}  # {(object_type, device group): task -> set of names}
+
+    async def __aenter__(self) -> "PanoramaApi":
+        """Open the http client"""
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Close the http client"""
+        await self.close()
+
+    def open(self) -> httpx.AsyncClient:
+        """
+        Create the (long-lived) http client, if it isn't already
+
+        The pool is sized to the limiter's maximum so every allowed request gets a
+        warm keep-alive connection instead of a new TLS handshake.
+
+        Returns:
+            httpx client
+        """
+        if self.client is not None:
+            return self.client
+
+        http2 = self.http2
+        if http2 and not HTTP2_AVAILABLE:
+            print("HTTP/2 requested but 'h2' isn't installed, using HTTP/1.1..")
+            logger.info("HTTP/2 requested but 'h2' isn't installed, using HTTP/1.1.")
+            http2 = False
+
+        pool_size = self.limiter.maximum
+        self.client = httpx.AsyncClient(
+            verify=False,  # Disable certificate verification
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=60,
+            ),
+            headers={"Accept-Encoding": "gzip"},
+            timeout=120,
+            transport=self.transport,
+        )
+        return self.client
+
+    async def close(self) -> None:
+        """Close the http client and its connections"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
 
     async def login(self) -> None:
         """
@@ -42,12 +267,12 @@ class PanoramaApi:
         Returs: None
         Raises: ?
         """
-        sess = httpx.AsyncClient(verify=False)  # Disable certificate verification
+        client = self.open()
         params = {"type": "keygen", "user": self.username, "password": self.password}
         url = f"https://{self.panorama}/api/"
 
         try:
-            response = await sess.get(url=url, params=params)
+            response = await client.get(url=url, params=params)
         except httpx.RequestError as e:
             print(f"{url=}")
             print("Request error: ", e)
@@ -62,13 +287,123 @@ class PanoramaApi:
 
         if key is not None:
             self.apikey = key.text
-            self.session[self.apikey] = sess
             self.login_data = {"X-PAN-KEY": self.apikey}
         else:
             print(f"Response was: {response.text}")
             print("Unable to retrieve API key...bad credentials?")
             sys.exit(1)
 
+        if self.cache_dir:
+            await self.enable_cache()
+
+    async def get_config_version(self) -> Union[None, str]:
+        """
+        Marker for the current config, it changes whenever the config does
+
+        Uses the id of the latest commit job, but only if there's nothing pending in
+        the candidate config (uncommitted changes don't move the marker).
+
+        Args: N/A
+
+        Returns:
+            config version string, or None if it can't be trusted
+        """
+        xml = await self.xml_request(
+            {"type": "op", "cmd": "<check><pending-changes></pending-changes></check>"}
+        )
+        if xml is None or xml.findtext("result") != "no":
+            return None
+
+        xml = await self.xml_request(
+            {"type": "op", "cmd": "<show><jobs><all></all></jobs></show>"}
+        )
+        if xml is None:
+            return None
+        commits = [
+            int(job.findtext("id"))
+            for job in xml.iterfind("result/job")
+            if (job.findtext("type") or "").lower().startswith("commit")
+            and (job.findtext("id") or "").isdigit()
+        ]
+        if not commits:
+            return None
+        return f"commit-{max(commits)}"
+
+    async def enable_cache(self) -> None:
+        """Start caching get_objects responses for the current config version"""
+        version = await self.get_config_version()
+        if version is None:
+            print("Uncommitted changes on Panorama, not using the response cache..")
+            logger.info("Config version unknown/pending changes, cache disabled.")
+            self.cache = None
+            return
+        logger.info(f"Using response cache for config version: {version}")
+        self.cache = ResponseCache(
+            directory=self.cache_dir,
+            panorama=self.panorama,
+            version=version,
+            max_mb=self.cache_max_mb,
+        )
+
+    def config_changed(self) -> None:
+        """We're changing the config, anything cached is stale now"""
+        if self.cache is not None:
+            logger.info("Config changed, response cache disabled for this run.")
+            self.cache = None
+
+    async def _request(
+        self, method: str, url: str, fatal: bool = True, **kwargs
+    ) -> Union[None, httpx.Response]:
+        """
+        Send a request through the shared limiter, retrying transient failures
+
+        Internal Error/5xx/429 responses and timeouts/connection errors are retried
+        with jittered exponential backoff (and the limiter backs off too).
+
+        Args:
+            method: GET/POST/DELETE
+            url: full url
+            fatal: exit if it still fails after all retries (reads), otherwise
+                return None/the last response so the caller can log it (writes)
+            kwargs: passed on to httpx
+
+        Returns:
+            httpx response
+        """
+        for attempt in range(self.retries + 1):
+            epoch = await self.limiter.acquire()
+            error = None
+            response = None
+            try:
+                response = await self.open().request(method, url, **kwargs)
+            except httpx.RequestError as e:
+                error = e
+            finally:
+                healthy = response is not None and not is_transient(response)
+                await self.limiter.release(healthy=healthy, epoch=epoch)
+
+            if healthy:
+                return response
+            if attempt < self.retries:
+                delay = random.uniform(0, min(30, 2**attempt))
+                logger.info(
+                    f"Retrying {url} in {delay:.1f}s: {error or response.status_code}"
+                )
+                await asyncio.sleep(delay)
+
+        logger.error(f"Giving up on {url} after {self.retries} retries.")
+        if error is not None:
+            print("Request error: ", error.request)
+            logger.error(f"Request Error: {url}.")
+            if fatal:
+                sys.exit()
+            return None
+        if fatal and response.status_code >= 500:
+            print(f"{url=}")
+            print("HTTP Status error: ", response.status_code)
+            sys.exit()
+        return response
+
     async def get_request(self, url: str, headers: Dict = None, params: Dict = None):
         """
         Generic GET Request
@@ -84,19 +419,10 @@ class PanoramaApi:
         url = self.base_url + url
         headers = self.login_data if not headers else self.login_data.update(headers)
 
-        try:
-            response = await self.session[self.apikey].get(
-                url=url, headers=headers, params=params, timeout=120
-            )
-            return response.json()
-        except httpx.RequestError as e:
-            print("Request error: ", e.request)
-            logger.error(f"Error getting {url}.")
-            sys.exit()
-        except httpx.HTTPStatusError as e:
-            print(f"{url=}")
-            print("HTTP Status error: ", e)
-            sys.exit()
+        response = await self._request(
+            "GET", url, headers=headers, params=params, timeout=120
+        )
+        return response.json()
 
     async def post_request(
         self, url: str, data: Dict, headers: Dict = None, params: Dict = None
@@ -113,22 +439,20 @@ class PanoramaApi:
         Raises: ?
         """
 
+        self.config_changed()
         url = self.base_url + url
         headers = self.login_data if not headers else self.login_data.update(headers)
 
-        try:
-            response = await self.session[self.apikey].post(
-                url=url, headers=headers, params=params, json=data, timeout=120
-            )
-            return response.json()
-        except httpx.RequestError as e:
-            print("Request error: ", e.request)
-            logger.error(f"Request Error: {url}.")
-            sys.exit()
-        except httpx.HTTPStatusError as e:
-            print(f"{url=}")
-            print("HTTP Status error: ", e)
-            sys.exit()
+        response = await self._request(
+            "POST",
+            url,
+            fatal=False,
+            headers=headers,
+            params=params,
+            json=data,
+            timeout=120,
+        )
+        return response.json() if response is not None else None
 
     async def delete_request(self, url: str, headers: Dict = None, params: Dict = None):
         """
@@ -143,22 +467,380 @@ class PanoramaApi:
         Raises: ?
         """
 
+        self.config_changed()
         url = self.base_url + url
         headers = self.login_data if not headers else self.login_data.update(headers)
 
+        response = await self._request(
+            "DELETE", url, fatal=False, headers=headers, params=params, timeout=120
+        )
+        return response.json() if response is not None else None
+
+    async def xml_request(self, params: Dict, timeout: int = 120):
+        """
+        Send an XML API request (POST, so large elements fit)
+
+        Args:
+            params: XML API parameters (type/action/xpath/element..)
+            timeout: request timeout
+
+        Returns:
+            <response> element, or None if the request/response failed
+        Raises: ?
+        """
+        url = f"https://{self.panorama}/api/"
+
+        response = await self._request(
+            "POST",
+            url,
+            fatal=False,
+            headers=self.login_data,
+            data=params,
+            timeout=timeout,
+        )
+        if response is None:
+            return None
+
         try:
-            response = await self.session[self.apikey].delete(
-                url=url, headers=headers, params=params, timeout=120
+            return etree.fromstring(response.content)
+        except etree.XMLSyntaxError:
+            logger.error(f"Invalid XML response from {url}: {response.text[:500]}")
+            return None
+
+    async def multi_config(self, actions: List[Tuple[str, str, Any]]) -> List[Tuple]:
+        """
+        Send many config changes in one XML API multi-config request
+
+        Args:
+            actions: List of (action, xpath, element) - action is 'set' or 'delete',
+                element is an lxml element (or None for deletes)
+
+        Returns:
+            List of (success, message) in the same order as actions
+        """
+        self.config_changed()
+        request = etree.Element("multi-configure-request")
+        for i, (action, xpath, element) in enumerate(actions, start=1):
+            sub = etree.SubElement(request, action, id=str(i), xpath=xpath)
+            if element is not None:
+                sub.append(element)
+
+        params = {
+            "type": "config",
+            "action": "multi-config",
+            "element": etree.tostring(request, encoding="unicode"),
+        }
+        xml = await self.xml_request(params=params, timeout=300)
+        if xml is None:
+            return [(False, "Invalid response")] * len(actions)
+
+        results = {
+            sub.get("id"): (sub.get("status") == "success", response_message(sub))
+            for sub in xml.iterfind("response")
+        }
+        if xml.get("status") == "success":
+            return [(True, "")] * len(actions)
+
+        message = response_message(xml)
+        return [
+            results.get(str(i), (False, message)) for i in range(1, len(actions) + 1)
+        ]
+
+    async def config_change(self, action: str, xpath: str, element=None) -> Tuple:
+        """
+        Single XML API config set/delete
+
+        Args:
+            action: 'set' or 'delete'
+            xpath: xpath to change
+            element: lxml element to set (None for deletes)
+
+        Returns:
+            (success, message)
+        """
+        self.config_changed()
+        params = {"type": "config", "action": action, "xpath": xpath}
+        if element is not None:
+            params["element"] = etree.tostring(element, encoding="unicode")
+        xml = await self.xml_request(params=params)
+        if xml is None:
+            return False, "Invalid response"
+        return xml.get("status") == "success", response_message(xml)
+
+    async def run_batched(
+        self,
+        actions: List[Tuple[str, str, Any]],
+        batch_size: int,
+        ordered: bool = False,
+    ) -> List[Tuple]:
+        """
+        Run config changes in multi-config batches of batch_size
+
+        A failed multi-config is rolled back by Panorama, so a failed batch is
+        retried one change at a time to find out which entries are actually bad.
+
+        Args:
+            actions: List of (action, xpath, element)
+            batch_size: changes per request
+            ordered: send batches one after the other instead of all at once
+
+        Returns:
+            List of (success, message) in the same order as actions
+        """
+
+        async def run_batch(batch):
+            results = await self.multi_config(batch)
+            if all(ok for ok, _ in results):
+                return results
+
+            logger.error(f"Batch of {len(batch)} failed, retrying one at a time.")
+            results = []
+            for action, xpath, element in batch:
+                results.append(await self.config_change(action, xpath, element))
+            return results
+
+        batch_size = max(1, batch_size)
+        batches = [
+            actions[i : i + batch_size] for i in range(0, len(actions), batch_size)
+        ]
+        if ordered:
+            batch_results = [await run_batch(batch) for batch in batches]
+        else:
+            batch_results = await asyncio.gather(*[run_batch(b) for b in batches])
+        return [result for results in batch_results for result in results]
+
+    async def create_objects(
+        self,
+        object_type: str,
+        objs: List[Dict],
+        device_group: List,
+        batch_size: int,
+        skip_existing: bool = False,
+    ) -> List[Tuple]:
+        """
+        Create many objects with batched XML API multi-config requests
+
+        A 'set' would merge into an object that already exists (adding members,
+        overwriting values), so objects that already exist are never sent. They fail
+        like the REST API does ('Object Not Unique'), unless skip_existing. What
+        exists is only pulled once per object type and device group (see
+        existing_names), creating more batches doesn't pull it again.
+
+        Args:
+            object_type: addresses/groups/service/groups/tags
+            objs: objects to create (as the REST API returns them)
+            device_group: device groups to create them in
+            batch_size: objects per request
+            skip_existing: count objects that already exist as created, left as they are
+
+        Returns:
+            List of (name, device group, success) for every object created
+        """
+        actions = []
+        labels = []
+        report = []
+        for group in device_group:
+            existing = await self.existing_names(object_type, group)
+            for obj in objs:
+                if not obj:
+                    continue
+                name = obj["@name"]
+                if existing is None:
+                    logger.error(f"Failed to create {object_type}:{name} in {group}:")
+                    logger.error("Unable to check for an existing object.")
+                    report.append((name, group, False))
+                elif name in existing:
+                    if skip_existing:
+                        logger.info(
+                            f"{object_type}:{name} already in {group}, left as is."
+                        )
+                    else:
+                        logger.error(
+                            f"Failed to create {object_type}:{name} in {group}:"
+                        )
+                        logger.error("Object Not Unique, it already exists.")
+                    report.append((name, group, skip_existing))
+                else:
+                    xpath = self.object_xpath(
+                        object_type=object_type, device_group=group
+                    )
+                    actions.append(("set", xpath, self.object_element(obj)))
+                    labels.append((name, group))
+
+        results = await self.run_batched(actions, batch_size)
+
+        for (name, group), (ok, message) in zip(labels, results):
+            if ok:
+                logger.info(f"Created {object_type}:{name} in {group}.")
+                await self.update_existing(object_type, group, name, exists=True)
+            else:
+                logger.error(f"Failed to create {object_type}:{name} in {group}:")
+                logger.error(message)
+            report.append((name, group, ok))
+        return report
+
+    async def existing_names(
+        self, object_type: str, device_group: str
+    ) -> Union[None, Set]:
+        """
+        Names of the objects of a type already in a device group (candidate config)
+
+        Pulled from Panorama the first time, then kept up to date as objects are
+        created/deleted through this PanoramaApi.
+
+        Args:
+            object_type: addresses/groups/service/groups/tags
+            device_group: device group, or 'shared'
+
+        Returns:
+            Set of names, or None if they couldn't be retrieved
+        """
+        key = (object_type, device_group)
+        task = self.existing.get(key)
+        if task is None:  # Concurrent batches wait on the same request
+            task = self.existing[key] = asyncio.ensure_future(
+                self._get_existing_names(object_type, device_group)
             )
-            return response.json()
-        except httpx.RequestError as e:
-            print("Request error: ", e.request)
-            logger.error(f"Request Error: {url}.")
-            sys.exit()
-        except httpx.HTTPStatusError as e:
-            print(f"{url=}")
-            print("HTTP Status error: ", e)
-            sys.exit()
+        names = await task
+        if names is None and self.existing.get(key) is task:
+            del self.existing[key]  # Try again next time
+        return names
+
+    async def update_existing(
+        self, object_type: str, device_group: str, name: str, exists: bool
+    ) -> None:
+        """
+        Record an object created in/deleted from a device group
+
+        Only if the device group's names were already pulled by existing_names.
+
+        Args:
+            object_type: addresses/groups/service/groups/tags
+            device_group: device group, or 'shared'
+            name: object name
+            exists: created (True) or deleted (False)
+        """
+        task = self.existing.get((object_type, device_group))
+        names = await task if task is not None else None
+        if names is None:
+            return
+        if exists:
+            names.add(name)
+        else:
+            names.discard(name)
+
+    async def _get_existing_names(
+        self, object_type: str, device_group: str
+    ) -> Union[None, Set]:
+        try:
+            xpath = self.object_xpath(
+                object_type=object_type, device_group=device_group
+            )
+        except ValueError as e:
+            logger.error(e)
+            return None
+        xml = await self.xml_request(
+            params={"type": "config", "action": "get", "xpath": xpath}
+        )
+        if xml is None or xml.get("status") != "success":
+            return None
+        return {entry.get("name") for entry in xml.iterfind("result/*/entry")}
+
+    async def delete_objects(
+        self, deletes: List[Tuple[str, str, str]], batch_size: int
+    ) -> List[Tuple]:
+        """
+        Delete many objects with batched XML API multi-config requests
+
+        Deletes are grouped per device group, each device group's batches are sent
+        in order (so groups listed before their members are deleted first), and
+        device groups run concurrently.
+
+        Args:
+            deletes: List of (object_type, device_group, name), device_group can be 'shared'
+            batch_size: objects per request
+
+        Returns:
+            List of (object_type, name, device group, success) for every delete
+        """
+        by_group = {}
+        for object_type, group, name in deletes:
+            by_group.setdefault(group, []).append((object_type, name))
+
+        async def delete_group(group, objs):
+            actions = []
+            for object_type, name in objs:
+                try:
+                    xpath = self.object_xpath(object_type, group, name=name)
+                except ValueError as e:  # Never send an xpath that could hit something else
+                    xpath = e
+                actions.append(("delete", xpath, None))
+            results = iter(
+                await self.run_batched(
+                    [action for action in actions if isinstance(action[1], str)],
+                    batch_size,
+                    ordered=True,
+                )
+            )
+
+            report = []
+            for (object_type, name), (_, xpath, _) in zip(objs, actions):
+                if isinstance(xpath, str):
+                    ok, message = next(results)
+                else:
+                    ok, message = False, str(xpath)
+                if ok:
+                    logger.info(f"Deleted {object_type}:{name} from {group}.")
+                    await self.update_existing(object_type, group, name, exists=False)
+                else:
+                    logger.error(f"Failed to delete {object_type}:{name} from {group}:")
+                    logger.error(message)
+                report.append((object_type, name, group, ok))
+            return report
+
+        reports = await asyncio.gather(
+            *[delete_group(group, objs) for group, objs in by_group.items()]
+        )
+        return [result for report in reports for result in report]
+
+    @staticmethod
+    def object_xpath(object_type: str, device_group: str, name: str = None) -> str:
+        """
+        XML API xpath for an object type (or a single object) in a device group
+
+        Args:
+            object_type: addresses/groups/service/groups/tags
+            device_group: device group, or 'shared'
+            name: object name (optional)
+
+        Returns:
+            xpath string
+        """
+        obj_type_formatted = PanoramaApi.format_object_type(object_type=object_type)
+        if device_group == "shared":
+            xpath = f"/config/shared/{obj_type_formatted}"
+        else:
+            xpath = (
+                "/config/devices/entry[@name='localhost.localdomain']/device-group"
+                f"/entry[@name={xpath_literal(device_group)}]/{obj_type_formatted}"
+            )
+        if name is not None:
+            xpath += f"/entry[@name={xpath_literal(name)}]"
+        return xpath
+
+    @staticmethod
+    def object_element(obj: Dict) -> etree._Element:
+        """
+        Convert an object (as the REST API returns it) into an XML API <entry>
+
+        Args:
+            obj: object dict
+
+        Returns:
+            <entry> element
+        """
+        obj = {k: v for k, v in obj.items() if k not in REMOVE_KEYS}
+        return etree.fromstring(xmltodict.unparse({"entry": obj}, full_document=False))
 
     async def get_device_groups(self):
         response = await self.get_request(url="Panorama/DeviceGroups")
@@ -176,16 +858,7 @@ class PanoramaApi:
             "/config/readonly/devices/entry[@name='localhost.localdomain']/device-group"
         )
         params = {"type": "config", "action": "get", "xpath": xpath, "key": self.apikey}
-        try:
-            response = await self.session[self.apikey].get(url=url, params=params)
-        except httpx.RequestError as e:
-            print("Request error: ", e.request)
-            logger.error(f"Request Error: {url}.")
-            sys.exit()
-        except httpx.HTTPStatusError as e:
-            print(f"{url=}")
-            print("HTTP Status error: ", e)
-            sys.exit()
+        response = await self._request("GET", url, params=params)
 
         parent_dgs = {}
         xml = etree.fromstring(response.text)
@@ -205,6 +878,39 @@ class PanoramaApi:
                 parent_dgs[dg_name] = None
         return parent_dgs
 
+    async def get_config(self) -> etree._Element:
+        """
+        Get the full candidate config in a single XML API request
+
+        Args: N/A
+
+        Returns:
+            <config> element
+        Raises: N/A
+        """
+        url = f"https://{self.panorama}/api/"
+        params = {
+            "type": "config",
+            "action": "get",
+            "xpath": "/config",
+            "key": self.apikey,
+        }
+        response = await self._request("GET", url, params=params, timeout=600)
+
+        try:
+            xml = etree.fromstring(response.content, parser=HUGE_PARSER)
+        except etree.XMLSyntaxError as e:
+            print(e)
+            print("XML error getting the candidate config")
+            sys.exit(1)
+
+        config = xml.find("result/config")
+        if config is None:
+            print(f"Response was: {response.text[:500]}")
+            print("Unable to retrieve the candidate config")
+            sys.exit(1)
+        return config
+
     async def get_objects(
         self, object_type: str, device_group: str = None, params: Dict = None
     ):
@@ -241,21 +947,26 @@ class PanoramaApi:
             print(f"Unsupported object_type sent: {object_type}")
             sys.exit(0)
 
+        cache_key = (url, sorted(params.items()))
+        if self.cache is not None:
+            objs = self.cache.get(cache_key)
+            if objs is not MISS:
+                return objs
+
+        objs = None
         response = await self.get_request(url=url, params=params)
         if not response.get("result"):
             logger.error(f"Failed getting object via: {url}")
             logger.error(f"Failed above, parameters: {params}")
-        elif int(response.get("result").get("@count")) > 0:
-            return response["result"]["entry"]
-
-        return None
+            return None
+        if int(response.get("result").get("@count")) > 0:
+            objs = response["result"]["entry"]
 
-    async def delete_object(self, limit, **kwargs) -> Union[None, str]:
-        async with limit:
-            result = await self._delete_object(**kwargs)
-            return result
+        if self.cache is not None:
+            self.cache.set(cache_key, objs)
+        return objs
 
-    async def _delete_object(
+    async def delete_object(
         self,
         object_type: str,
         name: str,
@@ -323,12 +1034,7 @@ class PanoramaApi:
 
         return None
 
-    async def create_object(self, limit, **kwargs) -> Union[None, str]:
-        async with limit:
-            result = await self._create_object(**kwargs)
-            return result
-
-    async def _create_object(
+    async def create_object(
         self, object_type: str, obj: Dict, device_group: List, set_output: bool
     ) -> Union[None, str]:
         """
@@ -341,8 +1047,6 @@ class PanoramaApi:
         Returns:
              response message (dict)
         """
-        remove_keys = ["@location", "@device-group", "@loc", "@overrides"]
-
         if object_type == "addresses":
             url = "Objects/Addresses"
         elif object_type == "address-groups":
@@ -364,7 +1068,7 @@ class PanoramaApi:
                 "name": obj["@name"],
             }
 
-            for k in remove_keys:
+            for k in REMOVE_KEYS:
                 if obj.get(k):
                     obj.pop(k)
 
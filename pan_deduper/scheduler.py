@@ -0,0 +1,158 @@
+"""pan_deduper.scheduler"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Tuple
+
+logger = logging.getLogger("utils")
+
+# run_batch(group, [(key, payload), ...]) -> [success, ...] (same order)
+RunBatch = Callable[[Tuple, List[Tuple[Hashable, Any]]], Awaitable[List[bool]]]
+
+
+class Scheduler:
+    """
+    Dependency graph of operations (creates/deletes)
+
+    Each operation is sent as soon as everything it depends on is done. Keys are tuples, everything but the last item is the key's 'group' (e.g.
+    ("create", "addresses", name) or ("delete", "addresses", device_group, name)).
+    Operations that are ready at the same time and share a group are sent together.
+    Dependencies on keys that were never added are ignored (nothing to wait for).
+    """
+
+    def __init__(self):
+        """Initialize an empty schedule"""
+        self.payloads = {}  # {key: payload}, in the order they were added
+        self.after = {}  # {key: [keys it depends on]}
+
+    def __len__(self) -> int:
+        """Count the operations"""
+        return len(self.payloads)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Is this operation in the schedule"""
+        return key in self.payloads
+
+    def add(self, key: Tuple, payload: Any = None, after: Iterable[Tuple] = ()) -> None:
+        """
+        Add an operation (or more dependencies for one already added)
+
+        Args:
+            key: operation key
+            payload: whatever run_batch needs to do the operation
+            after: keys that have to be done first
+        """
+        if key not in self.payloads:
+            self.payloads[key] = payload
+            self.after[key] = []
+        elif payload is not None:
+            self.payloads[key] = payload
+        self.after[key].extend(dep for dep in after if dep != key)
+
+    def _graph(self) -> Tuple[Dict, Dict]:
+        waiting = {}  # {key: number of dependencies not done yet}
+        dependents = {key: [] for key in self.payloads}
+        for key, deps in self.after.items():
+            deps = {dep for dep in deps if dep in self.payloads}
+            waiting[key] = len(deps)
+            for dep in deps:
+                dependents[dep].append(key)
+        return waiting, dependents
+
+    def order(self) -> List[Tuple]:
+        """
+        Every key, dependencies first (otherwise in the order they were added)
+
+        Returns:
+            List of keys
+        """
+        waiting, dependents = self._graph()
+        ready = [key for key in self.payloads if not waiting[key]]
+        ordered = []
+        while ready:
+            key = ready.pop(0)
+            ordered.append(key)
+            for dependent in dependents[key]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    ready.append(dependent)
+
+        if len(ordered) < len(self.payloads):
+            done = set(ordered)
+            stuck = [key for key in self.payloads if key not in done]
+            logger.error(f"Circular dependencies between: {stuck}")
+            ordered += stuck
+
+        return ordered
+
+    async def run(self, run_batch: RunBatch, batch_size: int) -> Dict[Tuple, bool]:
+        """
+        Run every operation, as soon as its dependencies succeed
+
+        If an operation fails, anything depending on it is skipped (and counted as
+        failed too).
+
+        Args:
+            run_batch: coroutine function doing a batch of operations of one group
+            batch_size: maximum operations per batch
+
+        Returns:
+            Dict of {key: success}
+        """
+        waiting, dependents = self._graph()
+        results = {}
+        ready = [key for key in self.payloads if not waiting[key]]
+        running = {}  # {task: keys}
+
+        def skip(key):
+            for dependent in dependents[key]:
+                if dependent not in results:
+                    logger.error(f"Skipping {dependent}, {key} failed.")
+                    results[dependent] = False
+                    skip(dependent)
+
+        def dispatch():
+            groups = {}
+            for key in ready:
+                groups.setdefault(key[:-1], []).append(key)
+            ready.clear()
+            for group, keys in groups.items():
+                for i in range(0, len(keys), batch_size):
+                    batch = keys[i : i + batch_size]
+                    items = [(key, self.payloads[key]) for key in batch]
+                    task = asyncio.ensure_future(run_batch(group, items))
+                    running[task] = batch
+
+        dispatch()
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    batch = running.pop(task)
+                    try:
+                        outcome = task.result()
+                    except Exception as e:
+                        logger.error(f"Batch {batch[0][:-1]} failed: {e}")
+                        outcome = [False] * len(batch)
+
+                    for key, ok in zip(batch, outcome):
+                        results[key] = ok
+                        if not ok:
+                            skip(key)
+                            continue
+                        for dependent in dependents[key]:
+                            waiting[dependent] -= 1
+                            if not waiting[dependent] and dependent not in results:
+                                ready.append(dependent)
+                dispatch()
+        finally:
+            for task in running:
+                task.cancel()
+
+        for key in self.payloads:
+            if key not in results:
+                logger.error(f"Skipping {key}, circular dependency.")
+                results[key] = False
+
+        return results
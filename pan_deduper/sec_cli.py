@@ -1,7 +1,6 @@
 """pan_deduper.sec_cli"""
 import asyncio
 import platform
-import sys
 from typing import Optional
 
 import typer
@@ -32,19 +31,11 @@ def xml(
     Command Line Entry via XML
 
     Args:
-        filename: filename.xml
+        filename: filename.xml (or .xml.gz/.bz2/.xz, or a .tgz bundle)
     """
     print("\n\tXML Time!\n")
-    try:
-        with open(filename, encoding="utf8") as f:
-            configstr = f.read()
-    except OSError as e:
-        print(e)
-        print("\nFile open failed...typo?\n")
-        sys.exit(1)
 
-    print("Not yet implemented, sorry!")
-    sys.exit()
+    asyncio.run(run_secduper(configfile=filename))
 
 
 @app.command("panorama", help="Gather Security Rules via Panorama")
@@ -21,5 +21,17 @@ TO_DEDUPE = [
 
 # If you already have a parent, but want to move objects into a new parent device group
 CLEANUP_DGS = []
-MAX_CONCURRENT = 10  # Maximum concurrent api requests to Panorama (lower if you are getting 'Internal Errors'
+MAX_CONCURRENT = 10  # Maximum concurrent api requests to Panorama (backs off on its own if Panorama is struggling)
+MAX_RETRIES = 5  # Retries for requests that fail with 'Internal Error', 5xx or timeouts
+HTTP2 = False  # Multiplex requests over HTTP/2 (requires: pip install httpx[http2])
+RESPONSE_CACHE = True  # Cache object lookups on disk, reused until Panorama's config changes (next commit)
+SNAPSHOT_CACHE = True  # Keep objects read from xml files, so the same file isn't parsed again next run
+SNAPSHOT_MAX_AGE_DAYS = 7  # Snapshots not used for this long are removed
+CACHE_DIR = ".deduper-cache"  # Where to keep the response cache/snapshots
+CACHE_MAX_MB = 500  # Oldest cached responses are removed past this size
+SNAPSHOT_MAX_MB = (
+    500  # Oldest snapshots are removed past this size (separate from CACHE_MAX_MB)
+)
+WORKERS = 0  # Processes used to check security rules (secduper), 0 for one per CPU
+BATCH_SIZE = 200  # Objects created/deleted per request when pushing to Panorama
 SET_OUTPUT = False  # Set to True if you only want 'set command' output instead of pushing to Panorama
@@ -1,23 +1,36 @@
 """pan_deduper.utils"""
 import asyncio
+import bz2
+import gzip
+import hashlib
 import importlib.resources as pkg_resources
 import importlib.util
 import inspect
+import io
 import json
 import logging
+import lzma
+import os
 import re
 import sys
+import tarfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from copy import deepcopy
 from datetime import datetime
-from itertools import combinations
 from typing import Any, Dict, List, Set, Tuple, Union
 
 import xmltodict
 from deepdiff import DeepDiff
 from lxml import etree
-from lxml.etree import XMLSyntaxError, XPathEvalError
+from lxml.etree import XMLSyntaxError
 from rich.pretty import pprint
+from rich.progress import Progress, TaskID
 
+from pan_deduper import settings as default_settings
+from pan_deduper.cache import MISS, SnapshotCache, file_digest
 from pan_deduper.panorama_api import PanoramaApi
+from pan_deduper.scheduler import Scheduler
 
 # Logging setup:
 logger = logging.getLogger("utils")
@@ -57,21 +70,59 @@ except (FileNotFoundError, ImportError, ModuleNotFoundError):
     )
     sys.exit(0)
 
-
-# def sec_rules_xml(configstr: str):
-#     rules = get_sec_rules_xml(configstr, "pre")
-#     t = rules[0]
-#     #print(dir(rules[0]))
-#     #breakpoint()
-#     #print(t.items)
-#     for child in t.getchildren():
-#         print(child.tag)
-#         member = child.find('member')
-#         breakpoint()
-#         if member is not None:
-#             print(member.text)
-#         else:
-#             print(child.text)
+# Settings added since the user's settings.py was created get the default value
+for _setting in dir(default_settings):
+    if _setting.isupper() and not hasattr(settings, _setting):
+        setattr(settings, _setting, deepcopy(getattr(default_settings, _setting)))
+
+# Keys that only say where an object lives, not what it is
+DEEP_IGNORE_KEYS = ("@loc", "@location", "@device-group", "@overrides")
+
+# Object type -> xml element name
+XML_OBJECT_TAGS = {
+    "addresses": "address",
+    "address-groups": "address-group",
+    "services": "service",
+    "service-groups": "service-group",
+    "tags": "tag",
+}
+
+# Object keys that refer to other objects (tags, group members)
+REFERENCE_KEYS = ("tag", "static", "members")
+
+# Group type -> object types its members can be
+OBJECT_MEMBER_TYPES = {
+    "address-groups": ["addresses", "address-groups"],
+    "service-groups": ["services", "service-groups"],
+}
+
+# Security rule fields that decide what a rule matches
+SHADOW_FIELDS = (
+    "from",
+    "to",
+    "source",
+    "destination",
+    "source-user",
+    "category",
+    "application",
+    "service",
+    "source-hip",
+    "destination-hip",
+    "hip-profiles",  # Pre 10.0 rules
+    "schedule",
+    "target",
+)
+
+# Object type -> entries, relative to a device group <entry> (or <shared>)
+LOCATION_ENTRIES = {
+    object_type: etree.XPath(f"{tag}/entry")
+    for object_type, tag in XML_OBJECT_TAGS.items()
+}
+LOCATION_ENTRIES["secrules-pre"] = etree.XPath("pre-rulebase/security/rules/entry")
+LOCATION_ENTRIES["secrules-post"] = etree.XPath("post-rulebase/security/rules/entry")
+CONFIG_DEVICE_GROUPS = etree.XPath(
+    "devices/entry[@name='localhost.localdomain']/device-group/entry"
+)
 
 
 async def get_sec_rules(pan: PanoramaApi, device_group: str):
@@ -86,58 +137,247 @@ async def get_sec_rules(pan: PanoramaApi, device_group: str):
     return rules
 
 
+def get_sec_rules_xml(filename: str) -> Dict:
+    """
+    Get pre/post security rules of every device group from an xml config
+
+    Same format as get_sec_rules(), in one streaming pass (no Panorama needed).
+
+    Args:
+        filename: xml (or compressed/archived xml) config filename
+
+    Returns:
+        Dict of {device-group: {"pre": [rules] or None, "post": [rules] or None}}
+    """
+    rules = {}
+    found_dgs = []
+    try:
+        with open_config(filename) as f:
+            for device_group, dg in iter_device_groups(f):
+                found_dgs.append(device_group)
+                if (
+                    settings.DEVICE_GROUPS
+                    and device_group not in settings.DEVICE_GROUPS
+                ):
+                    continue
+                rules[device_group] = {}
+                for prepost in ("pre", "post"):
+                    entries = location_entries(dg, f"secrules-{prepost}")
+                    rules[device_group][prepost] = [
+                        rule_to_dict(entry, device_group) for entry in entries
+                    ] or None
+    except (OSError, tarfile.TarError) as e:
+        print(e)
+        print("\nFile open failed...typo?\n")
+        sys.exit(1)
+
+    for device_group in settings.DEVICE_GROUPS:
+        if device_group not in found_dgs:
+            print(f"Device group {device_group} not found in {filename}, moving on...")
+
+    return rules
+
+
+def rule_to_dict(entry: etree._Element, device_group: str) -> Dict:
+    """
+    Convert an xml security rule <entry> into the dict format the API uses
+
+    Args:
+        entry: rule <entry> element
+        device_group: device group the rule is in
+
+    Returns:
+        Dict of the rule
+    """
+    rule = xml_to_dict(entry)
+    rule["@location"] = "device-group"
+    rule["@device-group"] = device_group
+    rule["@loc"] = device_group  # Rules in an xml config are never inherited
+    return rule
+
+
+def rule_signature(rule: Dict) -> Tuple:
+    """
+    Get what makes two security rules duplicates (everything but the source)
+
+    Args:
+        rule: security rule (dict)
+
+    Returns:
+        hashable signature
+    """
+    return (
+        rule["action"],
+        frozenset(rule["from"]["member"]),
+        frozenset(rule["destination"]["member"]),
+        frozenset(rule["service"]["member"]),
+        frozenset(rule["application"]["member"]),
+    )
+
+
 def check_sec_rules(rules: Dict):
+    """
+    Find rules that can be merged into an earlier rule
+
+    Same action, source zone, destination, service & application. Rules are bucketed by signature in a single pass, the first rule in a bucket
+    takes in the ones after it. A deny rule ends the buckets of every other action,
+    rules above a deny are never merged with rules below it. Inherited rules are
+    left alone.
+
+    Args:
+        rules: security rules, in rulebase order
+    Returns:
+        Dict of {first rule name: {"rules": [rules to merge], "tags": [new tags]}}
+    """
     rule_updates = {}
-    for i1, rule1 in enumerate(rules):
-        if rule1["@loc"] != rule1["@device-group"]:
+    positions = {}  # {rule name: position in the rulebase}
+    firsts = {}  # {signature: first rule}, non-deny actions
+    deny_firsts = {}  # {signature: first rule}, deny rules (never cut off)
+    for position, rule in enumerate(rules):
+        positions[rule["@name"]] = position
+        if rule["action"] == "deny":
+            firsts.clear()
+            buckets = deny_firsts
+        else:
+            buckets = firsts
+        if rule["@loc"] != rule["@device-group"]:  # If it was inherited
             continue
-        for i2, rule2 in enumerate(
-            rules[i1:]
-        ):  # Only check rules BELOW my current rule
-            name1 = rule1["@name"]
-            name2 = rule2["@name"]
-            action1 = rule1["action"]
-            action2 = rule2["action"]
-            src_zone1 = set(rule1["from"]["member"])
-            src_zone2 = set(rule2["from"]["member"])
-            destination1 = set(rule1["destination"]["member"])
-            destination2 = set(rule2["destination"]["member"])
-            service1 = set(rule1["service"]["member"])
-            service2 = set(rule2["service"]["member"])
-            application1 = set(rule1["application"]["member"])
-            application2 = set(rule2["application"]["member"])
-
-            new_tags = None
-            if rule1.get("tag"):
-                tags1 = set(rule1["tag"]["member"])
-                if rule2.get("tag"):
-                    tags2 = set(rule2["tag"]["member"])
-                new_tags = list(tags2.difference(tags1))
-
-            # Continue if same rule, break if I hit a deny and start on next rule
-            if name1 == name2:
-                continue
-            if action2 == "deny" and action1 != "deny":
-                break
-            if rule2["@loc"] != rule2["@device-group"]:  # If it was inherited
-                continue
 
-            if action1 == action2:
-                if destination2 == destination1:
-                    if service1 == service2:
-                        if application1 == application2:
-                            if src_zone2 == src_zone1:
-                                if not rule_updates.get(rule1["@name"]):
-                                    rule_updates[name1] = {"rules": [rule2]}
-                                else:
-                                    rule_updates[name1]["rules"].append(rule2)
-                                if new_tags:
-                                    if not rule_updates[name1].get("tags"):
-                                        rule_updates[name1]["tags"] = new_tags
-                                    else:
-                                        rule_updates[name1]["tags"] += new_tags
+        signature = rule_signature(rule)
+        first = buckets.get(signature)
+        if first is None:
+            buckets[signature] = rule
+            continue
+
+        name1 = first["@name"]
+        if not rule_updates.get(name1):
+            rule_updates[name1] = {"rules": [rule]}
+        else:
+            rule_updates[name1]["rules"].append(rule)
+
+        # Move over any tags the first rule doesn't have yet
+        tags1 = set(first.get("tag", {}).get("member", []))
+        new_tags = [
+            tag for tag in rule.get("tag", {}).get("member", []) if tag not in tags1
+        ]
+        if new_tags:
+            if not rule_updates[name1].get("tags"):
+                rule_updates[name1]["tags"] = new_tags
+            else:
+                rule_updates[name1]["tags"] += new_tags
+
+    # Same order as the rulebase, by first rule
+    return dict(sorted(rule_updates.items(), key=lambda item: positions[item[0]]))
+
+
+def rule_members(rule: Dict, field: str) -> Set[str]:
+    """
+    Members of a security rule field, a missing field matches anything
+
+    Args:
+        rule: security rule (dict)
+        field: from/to/source/destination/service/application/schedule/target..
+
+    Returns:
+        Set of members (target: device serials, no devices means every device)
+    """
+    value = rule.get(field)
+    if not value:
+        return {"any"}
+    if field == "target":
+        devices = (value.get("devices") or {}).get("entry") or []
+        if isinstance(devices, dict):
+            devices = [devices]
+        return {device["@name"] for device in devices} or {"any"}
+    if isinstance(value, dict):
+        return set(value.get("member") or ["any"])
+    return {value}
+
+
+def find_shadowed_rules(rules: List[Dict], earlier: List[Dict] = None) -> List:
+    """
+    Find rules that can never match
+
+    A rule above them already covers everything they would (every field the same,
+    a superset, or 'any'). Each field has an index of member -> bitset of the rules above that contain it,
+    so a rule's shadowing candidates are a handful of ANDs instead of a comparison
+    with every rule above it. Members are compared by name, groups aren't expanded.
+    Target devices, HIP profiles and schedules count too (a rule limited to some
+    devices or a schedule only covers those). Disabled and negated rules (source,
+    destination or target) are left out.
+
+    Args:
+        rules: security rules, in rulebase order
+        earlier: rules evaluated before these (pre-rulebase when checking post)
+
+    Returns:
+        List of (shadowed rule, first rule shadowing it), only for local rules
+    """
+    earlier = earlier or []
+    indexes = {field: {} for field in SHADOW_FIELDS}  # {field: {member: bitset}}
+    anys = dict.fromkeys(SHADOW_FIELDS, 0)  # {field: bitset of rules with 'any'}
+    candidates = 0  # Rules that can shadow others
+    ordered = earlier + rules
+    shadowed = []
+    for position, rule in enumerate(ordered):
+        usable = (
+            rule.get("disabled") != "yes"
+            and rule.get("negate-source") != "yes"
+            and rule.get("negate-destination") != "yes"
+            and (rule.get("target") or {}).get("negate") != "yes"
+        )
+        if not usable:
+            continue
+        members = {field: rule_members(rule, field) for field in SHADOW_FIELDS}
+
+        if position >= len(earlier) and rule["@loc"] == rule["@device-group"]:
+            covering = candidates
+            for field in SHADOW_FIELDS:
+                if "any" in members[field]:
+                    covering &= anys[field]
+                else:
+                    for member in members[field]:
+                        covering &= indexes[field].get(member, 0) | anys[field]
+                if not covering:
+                    break
+            if covering:
+                first = (covering & -covering).bit_length() - 1
+                shadowed.append((rule, ordered[first]))
+
+        bit = 1 << position
+        candidates |= bit
+        for field in SHADOW_FIELDS:
+            if "any" in members[field]:
+                anys[field] |= bit
+            else:
+                index = indexes[field]
+                for member in members[field]:
+                    index[member] = index.get(member, 0) | bit
+
+    return shadowed
+
+
+def create_shadowed_rule_output(shadowed: List, rulebase: str) -> List[str]:
+    """
+    Report lines for shadowed rules
+
+    Args:
+        shadowed: output of find_shadowed_rules()
+        rulebase: pre/post
 
-    return rule_updates
+    Returns:
+        List of lines
+    """
+    output = []
+    for rule, shadower in shadowed:
+        where = ""
+        if shadower["@loc"] != rule["@device-group"]:
+            where = f" in {shadower['@loc']}"
+        output.append(
+            f"{rulebase}-rulebase '{rule['@name']}' ({rule['action']}) can never match, "
+            f"'{shadower['@name']}' ({shadower['action']}){where} covers it"
+        )
+    return output
 
 
 def create_set_rule_output(updates, rulebase):
@@ -190,166 +430,297 @@ def create_set_rule_output(updates, rulebase):
     return output
 
 
+def make_panorama_api(panorama: str, username: str, password: str) -> PanoramaApi:
+    """
+    Create a PanoramaApi object using the connection settings from settings.py
+
+    Args:
+        panorama:   panorama IP/FQDN
+        username:   panorama username
+        password:   panorama password
+
+    Returns:
+        PanoramaApi object (use it with 'async with')
+    """
+    return PanoramaApi(
+        panorama=panorama,
+        username=username,
+        password=password,
+        max_concurrent=settings.MAX_CONCURRENT,
+        retries=settings.MAX_RETRIES,
+        http2=settings.HTTP2,
+        cache_dir=settings.CACHE_DIR if settings.RESPONSE_CACHE else None,
+        cache_max_mb=settings.CACHE_MAX_MB,
+    )
+
+
 async def run_secduper(
     panorama: str = None,
     username: str = None,
     password: str = None,
+    configfile: str = None,
 ) -> None:
+    """
+    Security rules deduper - BEGIN!
 
-    pan = PanoramaApi(panorama=panorama, username=username, password=password)
-    await pan.login()
-    print("Login successful")
+    Args:
+        panorama:   panorama IP/FQDN
+        username:   panorama username
+        password:   panorama password
+        configfile: xml config filename (instead of Panorama)
+    """
+    if configfile is not None:
+        print("Getting security rules..")
+        my_rules = get_sec_rules_xml(configfile)
+        write_sec_rules_output(my_rules)
+        return
 
-    my_rules = {}
-    if not settings.DEVICE_GROUPS:
-        settings.DEVICE_GROUPS = await pan.get_device_groups()
-    coroutines = []
-    for group in settings.DEVICE_GROUPS:
-        coroutines.append(get_sec_rules(pan=pan, device_group=group))
+    async with make_panorama_api(panorama, username, password) as pan:
+        await pan.login()
+        print("Login successful")
+
+        my_rules = {}
+        if not settings.DEVICE_GROUPS:
+            settings.DEVICE_GROUPS = await pan.get_device_groups()
+        coroutines = []
+        for group in settings.DEVICE_GROUPS:
+            coroutines.append(get_sec_rules(pan=pan, device_group=group))
 
-    print("Getting security rules..")
-    my_rules_temp = await asyncio.gather(*coroutines)
+        print("Getting security rules..")
+        my_rules_temp = await asyncio.gather(*coroutines)
     my_rules = {}
     for group in my_rules_temp:
         my_rules.update(group)
 
-    cmds = {}
-    for device_group, rules in my_rules.items():
-        cmds[device_group] = {}
-        print(f"checking {device_group} Pre")
-        cmds[device_group]["pre"] = [f"--------- PRE-RULEBASE ---------"]
-        if rules["pre"]:
-            updates = check_sec_rules(rules["pre"])
-            cmds[device_group]["pre"] += create_set_rule_output(updates, "pre")
-
-        print(f"checking {device_group} Post")
-        cmds[device_group]["post"] = [f"--------- POST-RULEBASE ---------"]
-        if rules["post"]:
-            updates = check_sec_rules(rules["post"])
-            cmds[device_group]["post"] += create_set_rule_output(updates, "post")
-
-    for device_group, rulebases in cmds.items():
-        with open(f"set-commands-sec_rules-{device_group}.txt", "w") as fin:
-            for prepost in rulebases:
-                if prepost:
-                    for cmd in cmds[device_group][prepost]:
-                        fin.write(f"{cmd}\n")
+    write_sec_rules_output(my_rules)
+
+
+def write_sec_rules_output(my_rules: Dict) -> None:
+    """
+    Check every device group's rules and write out the set commands
+
+    Device groups are checked in parallel (settings.WORKERS processes), each one's
+    output is written as soon as it's done.
+
+    Args:
+        my_rules: Dict of {device-group: {"pre": [rules], "post": [rules]}}
+    """
+    workers = min(settings.WORKERS or os.cpu_count() or 1, len(my_rules))
+    if workers <= 1:
+        for device_group, rules in my_rules.items():
+            write_device_group_output(*check_device_group_rules(device_group, rules))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(check_device_group_rules, device_group, rules)
+                for device_group, rules in my_rules.items()
+            ]
+            for future in as_completed(futures):
+                write_device_group_output(*future.result())
 
     print(
         "Done! Output of each device group at: set-commands-sec_rules-<groupname>.txt"
     )
+    print("Shadowed rules of each device group at: shadowed-rules-<groupname>.txt")
+
+
+def check_device_group_rules(device_group: str, rules: Dict) -> Tuple:
+    """
+    Check a device group's pre and post rules (runs in a worker process)
+
+    Args:
+        device_group: device group
+        rules: Dict of {"pre": [rules], "post": [rules]}
+
+    Returns:
+        (device_group, {"pre"/"post": [set commands]}, [shadowed rule lines])
+    """
+    cmds = {}
+    shadowed = []
+    cmds["pre"] = [f"--------- PRE-RULEBASE ---------"]
+    if rules["pre"]:
+        updates = check_sec_rules(rules["pre"])
+        cmds["pre"] += create_set_rule_output(updates, "pre")
+        shadowed += create_shadowed_rule_output(
+            find_shadowed_rules(rules["pre"]), "pre"
+        )
+
+    cmds["post"] = [f"--------- POST-RULEBASE ---------"]
+    if rules["post"]:
+        updates = check_sec_rules(rules["post"])
+        cmds["post"] += create_set_rule_output(updates, "post")
+        shadowed += create_shadowed_rule_output(
+            find_shadowed_rules(rules["post"], earlier=rules["pre"]), "post"
+        )
+
+    return device_group, cmds, shadowed
+
+
+def write_device_group_output(device_group: str, cmds: Dict, shadowed: List) -> None:
+    """
+    Write a device group's set commands and shadowed rules report
+
+    Args:
+        device_group: device group
+        cmds: Dict of {"pre"/"post": [set commands]}
+        shadowed: shadowed rule lines
+    """
+    with open(f"set-commands-sec_rules-{device_group}.txt", "w") as fin:
+        for prepost in cmds:
+            if prepost:
+                for cmd in cmds[prepost]:
+                    fin.write(f"{cmd}\n")
+    with open(f"shadowed-rules-{device_group}.txt", "w") as fin:
+        for line in shadowed or ["No shadowed rules found."]:
+            fin.write(f"{line}\n")
+    print(f"checked {device_group}")
 
 
 async def run_deduper(
     *,
     configstr: str = None,
+    configfile=None,
     panorama: str = None,
     username: str = None,
     password: str = None,
     deep: bool = False,
+    explain: bool = False,
+    bulk: bool = False,
 ) -> None:
     """
     Main program - BEGIN!
 
     Args:
         configstr:  xml config file string
+        configfile: xml config filename (streamed instead of read in whole)
         panorama:   panorama IP/FQDN
         username:   panorama username
         password:   panorama password
         deep:       deep check or not
+        explain:    add field-level differences to the deep check output
+        bulk:       get the full Panorama config in one request instead of per object type/DG
     """
     logger.info("")
     logger.info("----Running deduper---")
     logger.info("")
 
-    my_objs = []
-
-    if configstr:
-        my_objs = await get_objects_xml(configstr, deep)
+    pan = None
+    try:
+        my_objs = []
+        found = None
+        full_objs = None
+        config = None
+
+        if configfile is not None:
+            my_objs = await get_objects_file(configfile, deep=deep)
+
+        elif configstr:
+            my_objs = await get_objects_xml(configstr, deep=deep)
+
+        elif panorama:
+            pan = make_panorama_api(panorama, username, password)
+            await pan.login()
+            # settings.EXISTING_PARENT_DGS = await pan.get_parent_dgs()
+            # print("Parent Device Groups:")
+            # pprint(settings.EXISTING_PARENT_DGS)
+            if bulk:
+                print("Getting full candidate config..")
+                config = await pan.get_config()
+                my_objs = await get_objects_config(config, deep=deep)
+            else:
+                await set_device_groups(pan=pan, deep=deep)
+                found, full_objs = await find_duplicates_panorama(
+                    pan,
+                    deep=deep,
+                    explain=explain,
+                    keep_objects=settings.PUSH_TO_PANORAMA or settings.SET_OUTPUT,
+                    minimum=settings.MINIMUM_DUPLICATES,
+                )
 
-    elif panorama:
-        pan = PanoramaApi(panorama=panorama, username=username, password=password)
-        await pan.login()
-        # settings.EXISTING_PARENT_DGS = await pan.get_parent_dgs()
-        # print("Parent Device Groups:")
-        # pprint(settings.EXISTING_PARENT_DGS)
-        await set_device_groups(pan=pan, deep=deep)
-        if deep:
-            my_objs = await get_objects_panorama(pan, names_only=False)
-        else:
-            my_objs = await get_objects_panorama(pan)
+        print("\n\tDe-duplicating...\n")
+        if settings.MINIMUM_DUPLICATES <= 0:
+            print("Minimum duplicates set to 0, what are you doing?")
+            sys.exit()
+        results = {}
+        deep_dupes = {}
+        for object_type in settings.TO_DEDUPE:
+            results[object_type] = {}
+
+            if found is not None:  # Already deduped while fetching
+                duplicates, deep_dupes[object_type] = found[object_type]
+            elif deep:
+                duplicates, deep_dupes[object_type] = find_duplicates_deep(
+                    my_objects=my_objs[object_type],
+                    xml=config is not None,
+                    explain=explain,
+                    minimum=settings.MINIMUM_DUPLICATES,
+                )
+            else:
+                duplicates = find_duplicates(
+                    my_objects=my_objs[object_type],
+                    minimum=settings.MINIMUM_DUPLICATES,
+                )
 
-    print("\n\tDe-duplicating...\n")
-    if settings.MINIMUM_DUPLICATES <= 0:
-        print("Minimum duplicates set to 0, what are you doing?")
-        sys.exit()
-    results = {}
-    deep_dupes = {}
-    for object_type in settings.TO_DEDUPE:
-        objs = my_objs[object_type]
-        results[object_type] = {}
+            # Only duplicates that meet 'minimum' count (already filtered)
+            for dupe, dgs in duplicates.items():
+                if dupe:
+                    results[object_type][dupe] = dgs
 
         if deep:
-            duplicates, deep_dupes[object_type] = find_duplicates_deep(
-                my_objects=objs, xml=configstr
+            write_output("deep-dupes", deep_dupes)
+            print(
+                "\n\tAlmost/Maybe duplicates found with deep check are saved in deep-dupes.json"
             )
-        else:
-            duplicates = find_duplicates(my_objects=objs)
-
-        # Only duplicates that meet 'minimum' count
-        for dupe, dgs in duplicates.items():
-            if dupe:
-                if len(dgs) >= settings.MINIMUM_DUPLICATES:
-                    results[object_type].update({dupe: dgs})
-
-    if deep:
-        write_output("deep-dupes", deep_dupes)
-        print(
-            "\n\tAlmost/Maybe duplicates found with deep check are saved in deep-dupes.json"
-        )
 
-    write_output("duplicates", results)
-    print("\nDuplicates found: \n")
+        write_output("duplicates", results)
+        print("\nDuplicates found: \n")
 
-    length = 0
-    length += sum([len(v) for k, v in results.items()])
-    changes = 0
-    for _, obj_type in results.items():
-        for _, device_groups in obj_type.items():
-            changes += len(device_groups)
+        length = 0
+        length += sum([len(v) for k, v in results.items()])
+        changes = 0
+        for _, obj_type in results.items():
+            for _, device_groups in obj_type.items():
+                changes += len(device_groups)
 
-    if length == 0:
-        print("\nNone!")
-    else:
-        pprint(f"{length} objects found in total.")
-        pprint(f"{changes} object changes.")
-        if changes <= 50:
-            pprint(results)
+        if length == 0:
+            print("\nNone!")
         else:
-            answer = ask_user("Print them all? (y/n)")
-            if answer in ("yes", "y"):
+            pprint(f"{length} objects found in total.")
+            pprint(f"{changes} object changes.")
+            if changes <= 50:
                 pprint(results)
             else:
-                print()
-        if settings.PUSH_TO_PANORAMA and not configstr:
-            answer = ask_user(
-                "About to begin moving duplicate objects...continue? (y/n): "
-            )
-            if answer in ("yes", "y"):
-                await object_creation_deletion(pan=pan, results=results)
-        elif settings.SET_OUTPUT:
-            answer = ask_user("Ready to create set commands...continue? (y/n): ")
-            if answer in ("yes", "y"):
-                if "pan" not in locals():
-                    print("Not currently supported via XML.")
-                    sys.exit()
-                await create_set_output(pan=pan, results=results)
+                answer = ask_user("Print them all? (y/n)")
+                if answer in ("yes", "y"):
+                    pprint(results)
+                else:
+                    print()
+            if settings.PUSH_TO_PANORAMA and pan is not None:
+                answer = ask_user(
+                    "About to begin moving duplicate objects...continue? (y/n): "
+                )
+                if answer in ("yes", "y"):
+                    await object_creation_deletion(
+                        pan=pan, results=results, config=config, objs=full_objs
+                    )
+            elif settings.SET_OUTPUT:
+                answer = ask_user("Ready to create set commands...continue? (y/n): ")
+                if answer in ("yes", "y"):
+                    if pan is None:
+                        print("Not currently supported via XML.")
+                        sys.exit()
+                    await create_set_output(
+                        pan=pan, results=results, config=config, objs=full_objs
+                    )
 
-    print("\n\tDone! Results(duplicate list) also saved in duplicates.json.\n")
-    logger.info("Done.")
+        print("\n\tDone! Results(duplicate list) also saved in duplicates.json.\n")
+        logger.info("Done.")
+    finally:
+        if pan is not None:
+            await pan.close()
 
 
-def get_any_tags(objs):
+def get_any_tags(objs) -> Dict[str, List[str]]:
     """
     Get any tags so that we can build the objects properly
 
@@ -357,142 +728,320 @@ def get_any_tags(objs):
         objs: dict of duplicate objects {type: {dg: [objs]} }
 
     Returns:
-        tags: Dict of tags {dg: [tag names]}
+        tags: Dict of tags {dg: [tag names]}, in the order they were found
     """
-    tags = {}
+    tags = {}  # {dg: {tag name: None}}, dict as an ordered set
 
-    # Create Dict of {DG: [Tag names]}
     for object_type, device_groups in objs.items():
         for group, objects in device_groups.items():
             for obj in objects:
                 if obj.get("tag"):
                     members = obj["tag"].get("member")
                     if members:
-                        for tag in obj["tag"]["member"]:
-                            # Create empty if this is the first
-                            if not tags.get(group):
-                                tags[group] = []
-                            # Add Tag to list
-                            if tag not in tags[group]:
-                                tags[group].append(tag)
+                        tags.setdefault(group, {}).update(dict.fromkeys(members))
                     else:
                         message = f"Error pulling tag from: {obj}, exiting.."
                         logger.error(message)
                         print(message)
                         sys.exit(1)
 
-    return tags
+    return {group: list(names) for group, names in tags.items()}
+
+
+def tag_device_groups(tags: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """
+    Reverse a tags dict, tag name -> device groups using it
+
+    Args:
+        tags: Dict of tags {dg: [tag names]}
+
+    Returns:
+        Dict of {tag name: [device-groups]}, device groups in the same order as tags
+        (so the 1st one is the tag that gets cloned)
+    """
+    device_groups = {}
+    for dg, names in tags.items():
+        for tag in names:
+            device_groups.setdefault(tag, []).append(dg)
+    return device_groups
 
 
-async def create_tags(tags, pan: PanoramaApi, set_output: bool):
+async def get_full_tags(
+    tags, pan: PanoramaApi, config: etree._Element = None
+) -> Dict[str, Dict]:
     """
-    Create the tags
+    Get the full tags, so they can be cloned into the parent device group
 
     Args:
         tags: Dict of tags {dg: [tag names]}
         pan: Panorama API Object
-        set_output: set commands or no?
-    """
-
-    # Reorganize and ignore any duplicate names
-    # 1st tag found will be used as the clone in parent device group
-    to_create = {}
-    tag_list = []
-    for dg, tags in tags.items():
-        for tag in tags:
-            if tag not in tag_list:
-                tag_list.append(tag)
-                if not to_create.get(dg):
-                    to_create[dg] = []
-                to_create[dg].append(tag)
-
-    # Get and create tags
-    coroutines = []
-    limit = asyncio.Semaphore(value=settings.MAX_CONCURRENT)
-    for dg, tags in to_create.items():
-        for tag in tags:
-            params = {"location": "device-group", "device-group": f"{dg}", "name": tag}
-            full_tag = await pan.get_objects(
-                object_type="tags", device_group=dg, params=params
-            )
-            if not full_tag:
-                # # Check shared
-                # params = {"location": "shared", "name": tag}
-                # full_tag = await pan.get_objects(
-                #     object_type="tags",  params=params
-                # )
-                # if full_tag:
-                #     print(f"found {full_tag=} in shared")
-                #     full_tag[0]["@name"] = "FOUND_IN_SHARED-" + full_tag[0]["@name"]
-                #     print(f"found {full_tag=} in shared")
-                # else:
-                error = f"Error pulling tag {tag} from {dg}, must be complex hierarchy, please fix manually."
-                print(error)
-                logger.error(error)
-                continue
-            full_tag = full_tag[0]
-            coroutines.append(
-                pan.create_object(
-                    limit=limit,
-                    object_type="tags",
-                    obj=full_tag,
-                    device_group=settings.NEW_PARENT_DEVICE_GROUP,
-                    set_output=set_output,
-                )
+        config: full config already pulled from Panorama (bulk mode)
+
+    Returns:
+        Dict of {tag name: full tag}, 1st device group found with the tag wins
+    """
+    tag_dgs = tag_device_groups(tags)
+    firsts = {tag: dgs[0] for tag, dgs in tag_dgs.items()}
+
+    dg_tags = await get_dg_tags(
+        pan=pan, device_groups=list(dict.fromkeys(firsts.values())), config=config
+    )
+
+    full_tags = {}
+    for tag, dg in firsts.items():
+        full_tag = dg_tags[dg].get(tag)
+        if not full_tag:
+            error = f"Error pulling tag {tag} from {dg}, must be complex hierarchy, please fix manually."
+            print(error)
+            logger.error(error)
+            continue
+        full_tags[tag] = full_tag
+        if len(tag_dgs[tag]) > 1:
+            logger.info(
+                f"Tag {tag} is in {len(tag_dgs[tag])} device groups, cloning it from {dg}."
             )
 
-    return await asyncio.gather(*coroutines)
+    return full_tags
 
 
-async def delete_tags(tags, pan: PanoramaApi, set_output: bool):
+async def get_dg_tags(
+    pan: PanoramaApi, device_groups: List[str], config: etree._Element = None
+) -> Dict[str, Dict[str, Dict]]:
     """
-    Delete the tags
+    Get every tag of each device group, one request per device group (all at once)
+
     Args:
-        tags: Dict of tags {dg: [tag names]}
         pan: Panorama API Object
-        set_output: set commands or no?
+        device_groups: device groups to get tags from
+        config: full config already pulled from Panorama (bulk mode, no requests)
+
+    Returns:
+        Dict of {device-group: {tag name: full tag}}
     """
-    limit = asyncio.Semaphore(value=settings.MAX_CONCURRENT)
-    coroutines = []
-    for dg, tags in tags.items():
-        for tag in tags:
-            params = None
-            if tag.startswith("FOUND_IN_SHARED-"):
-                tag = tag.replace("FOUND_IN_SHARED", "")
-                params = {"location": "shared"}
-            coroutines.append(
-                pan.delete_object(
-                    limit=limit,
+    if config is not None:
+        all_tags = get_full_objects_config(
+            config=config, device_groups=device_groups, object_types=["tags"]
+        )["tags"]
+    else:
+        fetched = await asyncio.gather(
+            *[
+                pan.get_objects(
                     object_type="tags",
-                    name=tag,
                     device_group=dg,
-                    params=params,
-                    set_output=set_output,
+                    params={"location": "device-group", "device-group": f"{dg}"},
                 )
-            )
+                for dg in device_groups
+            ]
+        )
+        all_tags = dict(zip(device_groups, fetched))
 
-    return await asyncio.gather(*coroutines)
+    dg_tags = {}
+    for dg, objs in all_tags.items():
+        dg_tags[dg] = {}
+        for tag in objs or []:
+            dg_tags[dg].setdefault(tag["@name"], tag)
+
+    return dg_tags
 
 
-async def cleanup_tags(tags, pan: PanoramaApi, set_output: bool):
+def object_references(obj: Dict) -> Tuple[List[str], List[str]]:
+    """
+    Names an object refers to (and so have to exist before it)
+
+    Args:
+        obj: full object
+
+    Returns:
+        tags: tag names
+        members: group member names (empty if it's not a static group)
+    """
+    tags = (obj.get("tag") or {}).get("member") or []
+    members = (obj.get("static") or obj.get("members") or {}).get("member") or []
+    if isinstance(tags, str):
+        tags = [tags]
+    if isinstance(members, str):
+        members = [members]
+    return tags, members
+
+
+def build_schedule(
+    results: Dict, objs_list: Dict, tags: Dict, full_tags: Dict, index: Dict = None
+) -> Scheduler:
     """
-    Can't create the objects in Parent-DG if the Tag doesn't also exist there
+    Build the create/delete dependency graph
+
+    Creates (in the parent device group): tags, then members, then the groups they
+    are in (nested groups included). Deletes (from each device group) run the other
+    way: groups, then their members, then tags. Nothing is deleted from a device
+    group before it has been created in the parent.
 
     Args:
+        results: duplicates {object_type: {name: [device-groups]}}
+        objs_list: full objects {object_type: {device-group: [objects]}}
         tags: Dict of tags {dg: [tag names]}
+        full_tags: Dict of {tag name: full tag}
+        index: index_objects(objs_list), built here if not given
+
+    Returns:
+        Scheduler
+    """
+    schedule = Scheduler()
+    parents = settings.NEW_PARENT_DEVICE_GROUP
+    if index is None:
+        index = index_objects(objs_list)
+
+    for tag, full_tag in full_tags.items():
+        schedule.add(("create", "tags", tag), full_tag)
+
+    # What refers to what, in each device group
+    contained_in = {}  # {(dg, member name): [(group type, group name)]}
+    tagged_with = {}  # {(dg, tag): [(object type, name)]}
+    for object_type, device_groups in objs_list.items():
+        for dg, objs in device_groups.items():
+            for obj in objs:
+                if not obj:
+                    continue
+                obj_tags, members = object_references(obj)
+                for tag in obj_tags:
+                    tagged_with.setdefault((dg, tag), []).append(
+                        (object_type, obj["@name"])
+                    )
+                for member in members:
+                    contained_in.setdefault((dg, member), []).append(
+                        (object_type, obj["@name"])
+                    )
+
+    for object_type in settings.TO_DEDUPE:
+        member_types = OBJECT_MEMBER_TYPES.get(object_type, [])
+        for dupe, device_groups in results.get(object_type, {}).items():
+            # Get full object, just grab the object from the 1st dg
+            dupe_obj = find_object(
+                objs_list=objs_list,
+                object_type=object_type,
+                device_group=device_groups[0],
+                name=dupe,
+                index=index,
+            )
+            if not dupe_obj:
+                message = f"Error finding {object_type}:{dupe} in {device_groups[0]}, skipping."
+                logger.error(message)
+                print(message)
+                continue
+
+            create = ("create", object_type, dupe)
+            obj_tags, members = object_references(dupe_obj)
+            schedule.add(
+                create,
+                dupe_obj,
+                after=[("create", "tags", tag) for tag in obj_tags]
+                + [
+                    ("create", member_type, member)
+                    for member in members
+                    for member_type in member_types
+                ],
+            )
+
+            for group in device_groups:
+                if group in parents:  # do this better?
+                    continue
+                schedule.add(
+                    ("delete", object_type, group, dupe),
+                    after=[create]
+                    + [
+                        ("delete", group_type, group, group_name)
+                        for group_type, group_name in contained_in.get(
+                            (group, dupe), []
+                        )
+                    ],
+                )
+
+    for dg, names in tags.items():
+        if dg in parents:
+            continue
+        for tag in names:
+            schedule.add(
+                ("delete", "tags", dg, tag),
+                after=[("create", "tags", tag)]
+                + [
+                    ("delete", object_type, dg, name)
+                    for object_type, name in tagged_with.get((dg, tag), [])
+                ],
+            )
+
+    return schedule
+
+
+async def run_schedule(pan: PanoramaApi, schedule: Scheduler) -> Dict[Tuple, bool]:
+    """
+    Push the creates/deletes to Panorama
+
+    Each batch is sent as soon as what it depends on is done.
+
+    Args:
         pan: Panorama API Object
-        set_output: set commands or no?
+        schedule: Scheduler from build_schedule
+
+    Returns:
+        Dict of {key: success}
     """
-    tag_commands = []
-    tags_create = await create_tags(tags=tags, pan=pan, set_output=set_output)
-    tags_delete = await delete_tags(tags=tags, pan=pan, set_output=set_output)
 
-    if set_output:
-        for tag in tags_create:
-            tag_commands.append(tag)
-        for tag in tags_delete:
-            tag_commands.append(tag)
-        return tag_commands
+    async def run_batch(group, items):
+        if group[0] == "create":
+            report = await pan.create_objects(
+                object_type=group[1],
+                objs=[obj for _, obj in items],
+                device_group=settings.NEW_PARENT_DEVICE_GROUP,
+                batch_size=settings.BATCH_SIZE,
+                skip_existing=group[1] == "tags",  # Already there is all we need
+            )
+            created = {}
+            for name, _, ok in report:
+                created[name] = created.get(name, True) and ok
+            return [created.get(key[-1], False) for key, _ in items]
+
+        report = await pan.delete_objects(
+            deletes=[(group[1], group[2], key[-1]) for key, _ in items],
+            batch_size=settings.BATCH_SIZE,
+        )
+        return [ok for _, _, _, ok in report]
+
+    return await schedule.run(run_batch, batch_size=settings.BATCH_SIZE)
+
+
+async def schedule_set_output(pan: PanoramaApi, schedule: Scheduler) -> Dict:
+    """
+    Set commands for the creates/deletes, in dependency order
+
+    Args:
+        pan: Panorama API Object
+        schedule: Scheduler from build_schedule
+
+    Returns:
+        Dict of {object_type: [set commands]}
+    """
+    set_commands = {"tags": []}
+    for object_type in settings.TO_DEDUPE:
+        set_commands[object_type] = []
+
+    for key in schedule.order():
+        action, object_type = key[0], key[1]
+        if action == "create":
+            cmd = await pan.create_object(
+                object_type=object_type,
+                obj=schedule.payloads[key],
+                device_group=settings.NEW_PARENT_DEVICE_GROUP,
+                set_output=True,
+            )
+        else:
+            cmd = await pan.delete_object(
+                object_type=object_type,
+                name=key[-1],
+                device_group=key[2],
+                set_output=True,
+            )
+        set_commands.setdefault(object_type, []).append(cmd)
+
+    return set_commands
 
 
 def reorganize_commands(commands: List, rec):
@@ -530,10 +1079,12 @@ def bunch_commands(set_commands: Dict):
     return bunched_commands
 
 
-async def create_set_output(pan: PanoramaApi, results) -> None:
+async def create_set_output(
+    pan: PanoramaApi, results, config: etree._Element = None, objs: Dict = None
+) -> None:
     print("\n\nCreating set output...\n\n")
     set_commands = await object_creation_deletion(
-        pan=pan, results=results, set_output=True
+        pan=pan, results=results, set_output=True, config=config, objs=objs
     )
 
     # Create the 'one' file
@@ -556,98 +1107,80 @@ async def create_set_output(pan: PanoramaApi, results) -> None:
                     fin.write("\n")
 
 
-async def get_create_push_data(pan: PanoramaApi):
+async def get_create_push_data(
+    pan: PanoramaApi, config: etree._Element = None, objs: Dict = None
+):
     if not settings.NEW_PARENT_DEVICE_GROUP:
         print("\n\nYou didn't give me a parent device group to add objects to!!")
         print("Check settings.py\n\n")
         sys.exit()
 
-    print("Getting full objects...\n")
     # Get full objects so we can create them elsewhere
-    my_objs = await get_objects_panorama(pan=pan, names_only=False)
+    if objs is not None:  # Already kept from finding the duplicates
+        my_objs = objs
+    elif config is not None:
+        print("Getting full objects...\n")
+        my_objs = get_full_objects_config(
+            config=config,
+            device_groups=settings.DEVICE_GROUPS,
+            object_types=settings.TO_DEDUPE,
+        )
+    else:
+        print("Getting full objects...\n")
+        my_objs = await get_objects_panorama(pan=pan, names_only=False)
 
     print("\nChecking for any tags to clean up as well...")
     my_tags = get_any_tags(objs=my_objs)
 
-    return my_objs, my_tags
+    return my_objs, my_tags, index_objects(my_objs)
 
 
 async def object_creation_deletion(
-    pan: PanoramaApi, results, set_output: bool = False
+    pan: PanoramaApi,
+    results,
+    set_output: bool = False,
+    config: etree._Element = None,
+    objs: Dict = None,
 ) -> Union[None, Dict]:
     """
     Create and delete objects or output set commands
 
     Args:
-        pan:
-        results:
-        set_output:
-    Returns:
+        pan: Panorama API Object
+        results: duplicates {object_type: {name: [device-groups]}}
+        set_output: only output set commands, nothing is pushed
+        config: full config already pulled from Panorama (bulk mode)
+        objs: full objects already pulled from Panorama (while finding duplicates)
 
+    Returns:
+        Dict of {object_type: [set commands]} (empty when pushing)
     """
-    my_objs, my_tags = await get_create_push_data(pan=pan)
-    set_commands = {"tags": []}
-
-    # Cleanup tags first
-    tags = await cleanup_tags(tags=my_tags, pan=pan, set_output=set_output)
-    if tags:
-        set_commands["tags"] += tags
+    my_objs, my_tags, my_index = await get_create_push_data(
+        pan=pan, config=config, objs=objs
+    )
+    full_tags = await get_full_tags(tags=my_tags, pan=pan, config=config)
+
+    # Tags -> members -> groups -> nested groups, deletes the other way around
+    schedule = build_schedule(
+        results=results,
+        objs_list=my_objs,
+        tags=my_tags,
+        full_tags=full_tags,
+        index=my_index,
+    )
 
     if set_output:
-        for each in settings.TO_DEDUPE:
-            set_commands[each] = []
-            # Creates (set commands)
-            cmds = await do_the_creates(
-                object_types=[each],
-                pan=pan,
-                results=results,
-                objs_list=my_objs,
-                set_output=set_output,
-            )
-            for cmd in cmds:
-                set_commands[each].append(cmd)
-            # Deletes (set commands)
-            cmds = await do_the_deletes(
-                object_types=[each], pan=pan, results=results, set_output=set_output
-            )
-            # for cmd in cmds:
-            #     set_commands[each].append(cmd)
-            set_commands[each] += cmds
+        set_commands = await schedule_set_output(pan=pan, schedule=schedule)
 
     else:  # Actually pushing to Panorama
-        print("\nCreating objects...")
-        await do_the_creates(
-            object_types=["addresses", "services"],
-            pan=pan,
-            results=results,
-            objs_list=my_objs,
-            set_output=set_output,
-        )
-
-        print("\nCreating object groups...")
-        await do_the_creates(
-            object_types=["address-groups", "service-groups"],
-            pan=pan,
-            results=results,
-            objs_list=my_objs,
-            set_output=set_output,
-        )
-
-        # Now do the deletes
-        print("\nDeleting object groups...")
-        await do_the_deletes(
-            object_types=["address-groups", "service-groups"],
-            pan=pan,
-            results=results,
-            set_output=set_output,
-        )
-        print("\nDeleting objects...")
-        await do_the_deletes(
-            object_types=["addresses", "services"],
-            pan=pan,
-            results=results,
-            set_output=set_output,
-        )
+        set_commands = {}
+        print("\nMoving objects...")
+        outcome = await run_schedule(pan=pan, schedule=schedule)
+        failed = [key for key, ok in outcome.items() if not ok]
+        if failed:
+            print(
+                f"\t{len(failed)} of {len(outcome)} creates/deletes failed or were skipped, see deduper.log"
+            )
 
     # Now lets delete shared (to delete!!)
     if settings.DELETE_SHARED_OBJECTS:
@@ -658,9 +1191,16 @@ async def object_creation_deletion(
         else:
             answer = ask_user("\n\tAll cleaned up...cleanup 'shared' also? (y/n): ")
         if answer in ("yes", "y"):
-            shared_objs = await get_objects_panorama(
-                pan=pan, shared=True, names_only=True
-            )
+            if config is not None:
+                shared_objs = get_names_config(
+                    config=config,
+                    device_groups=["shared"],
+                    object_types=settings.TO_DEDUPE,
+                )
+            else:
+                shared_objs = await get_objects_panorama(
+                    pan=pan, shared=True, names_only=True
+                )
 
             # Find shared dupes
             shared_deletes = find_duplicates_shared(
@@ -709,13 +1249,20 @@ async def object_creation_deletion(
         return set_commands
 
 
-async def set_device_groups(*, config=None, pan: PanoramaApi = None, deep: bool = None):
+async def set_device_groups(
+    *,
+    config=None,
+    device_groups: List[str] = None,
+    pan: PanoramaApi = None,
+    deep: bool = None,
+):
     """
     Set the device groups that will be searched through
 
     Args:
         only 1 of below should be provided
-        config: xml config string (if provided)
+        config: xml config (if provided)
+        device_groups: device groups found in a streamed xml config (if provided)
         pan: panorama object (if provided)
         deep: deep check or not
     Returns:
@@ -731,6 +1278,9 @@ async def set_device_groups(*, config=None, pan: PanoramaApi = None, deep: bool
             if dgs is not None:
                 for entry in dgs.getchildren():
                     settings.DEVICE_GROUPS.append(entry.get("name"))
+    elif device_groups is not None:
+        if not settings.DEVICE_GROUPS:
+            settings.DEVICE_GROUPS.extend(device_groups)
     else:
         if not settings.DEVICE_GROUPS:
             settings.DEVICE_GROUPS = await pan.get_device_groups()
@@ -798,11 +1348,14 @@ async def get_objects_panorama(
     """
 
     # Get objects
-    coroutines = [
-        _get_objects_panorama(pan, object_type, names_only, shared)
-        for object_type in settings.TO_DEDUPE
-    ]
-    my_objs_temp = await asyncio.gather(*coroutines)
+    with Progress() as progress:
+        coroutines = [
+            _get_objects_panorama(
+                pan, object_type, names_only, shared, progress=progress
+            )
+            for object_type in settings.TO_DEDUPE
+        ]
+        my_objs_temp = await asyncio.gather(*coroutines)
 
     # Convert/merge list of dicts into one dictionary
     my_objs = {}
@@ -811,14 +1364,151 @@ async def get_objects_panorama(
     return my_objs
 
 
+async def find_duplicates_panorama(
+    pan: PanoramaApi,
+    deep: bool = False,
+    explain: bool = False,
+    keep_objects: bool = False,
+    minimum: int = 2,
+) -> Tuple[Dict, Union[None, Dict]]:
+    """
+    Get objects from Panorama and dedupe them as they arrive
+
+    Every (object type, device group) is fetched at once, and each response is
+    added to its object type's index as soon as it comes in, so the dedupe work
+    happens while we're waiting on the rest of the responses.
+
+    Args:
+        pan:    Panorama API Object
+        deep:   deep check (compare values) or names only
+        explain: include a field-level DeepDiff for each almost-duplicate (deep)
+        keep_objects: also return the full objects, so they don't have to be
+            fetched again to create/delete them
+        minimum: only duplicates in at least this many device groups
+
+    Returns:
+        found: Dict of {object_type: (duplicates, deep diffs or None)}
+        full objects: Dict of {object_type: {device-group: [objects]}}, only the
+            duplicates are kept (None unless keep_objects)
+    """
+    indexes = {
+        object_type: DeepIndex(settings.DEVICE_GROUPS)
+        if deep
+        else ObjectIndex(settings.DEVICE_GROUPS)
+        for object_type in settings.TO_DEDUPE
+    }
+    kept = {}
+    if keep_objects:
+        kept = {
+            object_type: KeptObjects(settings.DEVICE_GROUPS)
+            for object_type in settings.TO_DEDUPE
+        }
+    remaining = dict.fromkeys(settings.TO_DEDUPE, len(settings.DEVICE_GROUPS))
+    found = {}
+    full_objs = {} if keep_objects else None
+
+    def finish(object_type):
+        # Every device group is in, so the duplicates are known
+        index = indexes.pop(object_type)
+        if deep:
+            found[object_type] = index.duplicates(explain=explain, minimum=minimum)
+        else:
+            found[object_type] = (index.duplicates(minimum=minimum), None)
+        if keep_objects:  # Only the duplicates will be created/deleted
+            full_objs[object_type] = kept.pop(object_type).objects(
+                found[object_type][0]
+            )
+
+    for object_type, count in remaining.items():
+        if not count:  # No device groups, nothing will arrive to finish it
+            finish(object_type)
+
+    queue = asyncio.Queue()
+
+    async def fetch(object_type, device_group, progress, task):
+        try:
+            objs = await _get_dg_objects(
+                pan=pan,
+                object_type=object_type,
+                device_group=device_group,
+                progress=progress,
+                task=task,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            objs = e  # Hand it to the consumer, so it isn't left waiting
+        await queue.put((object_type, device_group, objs))
+
+    with Progress() as progress:
+        fetches = []
+        for object_type in settings.TO_DEDUPE:
+            task = progress.add_task(
+                f"Getting {object_type}", total=len(settings.DEVICE_GROUPS)
+            )
+            fetches += [
+                asyncio.create_task(fetch(object_type, dg, progress, task))
+                for dg in settings.DEVICE_GROUPS
+            ]
+
+        try:
+            for _ in range(len(fetches)):
+                object_type, dg, objs = await queue.get()
+                if isinstance(objs, Exception):
+                    raise objs
+                remaining[object_type] -= 1
+                if not objs:
+                    print(f"No {object_type} found in {dg}, moving on...")
+                else:
+                    objs = format_objs(
+                        objs=objs,
+                        device_group=dg,
+                        names_only=not (deep or keep_objects),
+                    )
+                    if deep:
+                        indexes[object_type].add(dg, objs, kept=kept.get(object_type))
+                    elif keep_objects:
+                        for obj in objs:
+                            kept[object_type].add(dg, obj)
+                        indexes[object_type].add(dg, [obj["@name"] for obj in objs])
+                    else:
+                        indexes[object_type].add(dg, objs)
+                if not remaining[object_type]:
+                    finish(object_type)
+        finally:
+            for fetch_task in fetches:
+                fetch_task.cancel()
+
+    # Same order as TO_DEDUPE, whichever finished first
+    found = {object_type: found[object_type] for object_type in settings.TO_DEDUPE}
+    if keep_objects:
+        full_objs = {
+            object_type: full_objs[object_type] for object_type in settings.TO_DEDUPE
+        }
+    return found, full_objs
+
+
 async def _get_objects_panorama(
-    pan: PanoramaApi, object_type: str, names_only: bool = True, shared: bool = False
+    pan: PanoramaApi,
+    object_type: str,
+    names_only: bool = True,
+    shared: bool = False,
+    progress: Progress = None,
 ):
-    my_objs = {object_type: {}}
+    """
+    Get one object type from every device group (or shared)
 
-    print(f"Getting {object_type}/checking for duplicates..")
+    Args:
+        pan:    Panorama API Object
+        object_type: object type to get
+        names_only: return only the names or the full object
+        shared: pull from shared (to delete!)
+        progress: rich progress bar to report on
+    Returns:
+        Dict of {object_type: {device-group: objects}}
+    """
+    my_objs = {object_type: {}}
 
     if shared:
+        print(f"Getting {object_type}/checking for duplicates..")
         params = {"location": "shared"}
         objs = await pan.get_objects(object_type=object_type, params=params)
         if not objs:
@@ -829,11 +1519,26 @@ async def _get_objects_panorama(
                 objs=objs, device_group="shared", names_only=names_only
             )
     else:
-        for dg in settings.DEVICE_GROUPS:
-            my_objs[object_type][dg] = []
-            # Get objects
-            params = {"location": "device-group", "device-group": f"{dg}"}
-            objs = await pan.get_objects(object_type=object_type, params=params)
+        task = None
+        if progress is not None:
+            task = progress.add_task(
+                f"Getting {object_type}", total=len(settings.DEVICE_GROUPS)
+            )
+
+        # Every device group at once (pan.limiter keeps it sane), gather() keeps order
+        coroutines = [
+            _get_dg_objects(
+                pan=pan,
+                object_type=object_type,
+                device_group=dg,
+                progress=progress,
+                task=task,
+            )
+            for dg in settings.DEVICE_GROUPS
+        ]
+        all_objs = await asyncio.gather(*coroutines)
+
+        for dg, objs in zip(settings.DEVICE_GROUPS, all_objs):
             if not objs:
                 print(f"No {object_type} found in {dg}, moving on...")
                 my_objs[object_type][dg] = set([])
@@ -845,6 +1550,33 @@ async def _get_objects_panorama(
     return my_objs
 
 
+async def _get_dg_objects(
+    pan: PanoramaApi,
+    object_type: str,
+    device_group: str,
+    progress: Progress = None,
+    task: TaskID = None,
+):
+    """
+    Get one object type from one device group
+
+    Args:
+        pan:    Panorama API Object
+        object_type: object type to get
+        device_group: device group
+        progress: rich progress bar to advance when done
+        task: progress bar task
+
+    Returns:
+        List of objects (or None)
+    """
+    params = {"location": "device-group", "device-group": f"{device_group}"}
+    objs = await pan.get_objects(object_type=object_type, params=params)
+    if progress is not None:
+        progress.advance(task)
+    return objs
+
+
 def format_objs(
     objs: List[Dict], device_group: str, names_only: bool
 ) -> Union[Set, List]:
@@ -887,48 +1619,292 @@ async def get_objects_xml(configstr, obj_type=None, deep=None) -> Dict:
     Get objects from xml file instead of Panorama
 
     Args:
-        configstr: xml filename
+        configstr: xml config string
         deep: deep search or not
     Returns:
          Dict/list of objects
     Raises:
         N/A
     """
+    if isinstance(configstr, str):
+        configstr = configstr.encode("utf8")
+    return await stream_objects_xml(io.BytesIO(configstr), deep=deep)
+
+
+async def get_objects_file(filename: str, deep=None) -> Dict:
+    """
+    Get objects from an xml config file
+
+    Uses a snapshot from an earlier run of the same file if there is one. Snapshots
+    hold every object type for every device group, so changing settings
+    between runs doesn't need the file parsed again. Without snapshots, only the
+    device groups/object types settings.py asks for are collected.
+
+    Args:
+        filename: xml (or compressed/archived xml) config filename
+        deep: deep search or not
+
+    Returns:
+         Dict/list of objects
+    """
+    kind = "deep" if deep else "names"
     try:
-        config = etree.fromstring(configstr)
-    except XMLSyntaxError as exc:
-        print(exc)
-        print("\nInvalid XML File...try again! Our best guess is up there ^^^\n")
+        if not settings.SNAPSHOT_CACHE:
+            with open_config(filename) as f:
+                return await stream_objects_xml(f, deep=deep)
+
+        snapshots = SnapshotCache(
+            directory=settings.CACHE_DIR,
+            max_mb=settings.SNAPSHOT_MAX_MB,
+            max_age_days=settings.SNAPSHOT_MAX_AGE_DAYS,
+        )
+        digest = file_digest(filename)
+        snapshot = snapshots.get(digest, kind)
+        if snapshot is not MISS:
+            print("Using snapshot from a previous run of this file..")
+            logger.info(f"Using {kind} snapshot {digest} for {filename}")
+            return await select_objects_xml(*snapshot, deep=deep)
+
+        with open_config(filename) as f:
+            found_dgs, found = extract_objects_xml(
+                f, deep=deep, object_types=list(XML_OBJECT_TAGS)
+            )
+    except (OSError, tarfile.TarError) as e:
+        print(e)
+        print("\nFile open failed...typo?\n")
         sys.exit(1)
 
+    snapshots.set(digest, kind, (found_dgs, found))
+    return await select_objects_xml(found_dgs, found, deep=deep)
+
+
+async def stream_objects_xml(source, deep=None) -> Dict:
+    """
+    Get objects from an xml file, one device group at a time
+
+    The file is never fully in memory, each device group is dropped once its
+    objects have been collected.
+
+    Args:
+        source: filename or (binary) file object
+        deep: deep search or not, objects are dicts (like the API gives us) if so
+
+    Returns:
+         Dict/list of objects
+    """
+    skip = set(settings.EXCLUDE_DEVICE_GROUPS) | set(settings.NEW_PARENT_DEVICE_GROUP)
+
+    def wanted(dg_name):
+        if dg_name in skip:
+            return False
+        return not settings.DEVICE_GROUPS or dg_name in settings.DEVICE_GROUPS
+
+    found_dgs, found = extract_objects_xml(
+        source, deep=deep, object_types=settings.TO_DEDUPE, wanted=wanted
+    )
+    return await select_objects_xml(found_dgs, found, deep=deep)
+
+
+def extract_objects_xml(
+    source, deep: bool, object_types: List[str], wanted=None
+) -> Tuple[List[str], Dict]:
+    """
+    Collect objects from every device group of a streamed xml config
+
+    Args:
+        source: filename or (binary) file object
+        deep: dicts (like the API gives us) instead of just names
+        object_types: object types to collect
+        wanted: only collect device groups this returns True for (default all)
+
+    Returns:
+        (all device group names found, {object_type: {device-group: objects}})
+    """
+    found_dgs = []
+    found = {object_type: {} for object_type in object_types}
+    for dg_name, dg in iter_device_groups(source):
+        found_dgs.append(dg_name)
+        if wanted is not None and not wanted(dg_name):
+            continue
+        for object_type in object_types:
+            entries = location_entries(dg, object_type)
+            if deep:
+                found[object_type][dg_name] = [xml_to_dict(e) for e in entries]
+            else:
+                found[object_type][dg_name] = {e.get("name") for e in entries}
+
+    return found_dgs, found
+
+
+async def select_objects_xml(found_dgs: List[str], found: Dict, deep=None) -> Dict:
+    """
+    Narrow objects from an xml config down to what settings.py asks for
+
+    Args:
+        found_dgs: all device groups in the config
+        found: {object_type: {device-group: objects}}
+        deep: deep search or not
+
+    Returns:
+         Dict/list of objects
+    """
+    # Get device groups and compare/merge with settings.py
+    await set_device_groups(device_groups=found_dgs, deep=deep)
+
+    # Get objects - build into x[type][device-group][name1,name2,...]
+    my_objs = {}
+    for object_type in settings.TO_DEDUPE:
+        my_objs[object_type] = {}
+        for dg in settings.DEVICE_GROUPS:
+            objs = found.get(object_type, {}).get(dg)
+            if not objs:
+                print(f"No {object_type} found in {dg}, moving on...")
+                objs = [] if deep else set()
+            my_objs[object_type][dg] = objs
+
+    return my_objs
+
+
+# Magic bytes -> how to decompress a config file
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": lambda f: gzip.GzipFile(fileobj=f),
+    b"BZh": bz2.BZ2File,
+    b"\xfd7zXZ\x00": lzma.LZMAFile,
+}
+# Preferred config files inside an archive (Panorama device-state bundles)
+ARCHIVE_CONFIG_NAMES = ("running-config.xml", "panorama.xml")
+
+
+@contextmanager
+def open_config(filename: str):
+    """
+    Open a config file for streaming, decompressing/unarchiving it on the fly
+
+    gzip, bz2 and xz (by content, not extension) and tar archives of any of those
+    are supported, nothing is written to disk. From an archive the first
+    running-config.xml/panorama.xml is used, or the first .xml file if there's neither.
+
+    Args:
+        filename: config filename
+
+    Yields:
+        binary file object of the xml config
+
+    Raises:
+        OSError/tarfile.TarError if the file can't be opened/read
+    """
+    with ExitStack() as stack:
+        stream = stack.enter_context(_open_decompressed(filename))
+        if not _is_tar(stream):
+            yield stream
+            return
+
+        for wanted in (ARCHIVE_CONFIG_NAMES, None):
+            stack.close()
+            stream = stack.enter_context(_open_decompressed(filename))
+            tar = stack.enter_context(tarfile.open(fileobj=stream, mode="r|"))
+            for member in tar:
+                name = os.path.basename(member.name)
+                if not member.isfile() or not name.endswith(".xml"):
+                    continue
+                if wanted is None or name in wanted:
+                    logger.info(f"Using {member.name} from {filename}")
+                    yield tar.extractfile(member)
+                    return
+
+        raise tarfile.TarError(f"No .xml config found in {filename}")
+
+
+@contextmanager
+def _open_decompressed(filename: str):
+    """Open a file, decompressing it if it's compressed"""
+    with open(filename, "rb") as f:
+        magic = f.read(6)
+        f.seek(0)
+        for prefix, decompressor in COMPRESSION_MAGIC.items():
+            if magic.startswith(prefix):
+                with decompressor(f) as stream:
+                    yield io.BufferedReader(stream)
+                return
+        yield f
+
+
+def _is_tar(stream: io.BufferedReader) -> bool:
+    """Peek at a (decompressed) stream to see if it's a tar archive"""
+    header = stream.peek(512)[:512]
+    return len(header) >= 262 and header[257:262] == b"ustar"
+
+
+def iter_device_groups(source):
+    """
+    Stream the device groups out of an xml config
+
+    Everything outside of the device groups is thrown away as soon as it's parsed,
+    and each device group is cleared once the caller moves on to the next one.
+
+    Args:
+        source: filename or (binary) file object
+
+    Yields:
+        (device group name, device group <entry> element)
+    """
+    dg_path = ("config", "devices", "entry", "device-group", "entry")
+    path = []  # Tags from the root to the current element
+    in_dg = False
     try:
-        config.xpath("./devices/entry[@name='localhost.localdomain']/device-group")
-    except XPathEvalError as exc:
+        for event, elem in etree.iterparse(
+            source, events=("start", "end"), huge_tree=True
+        ):
+            if event == "start":
+                path.append(elem.tag)
+                if tuple(path) == dg_path:
+                    in_dg = elem.getparent().getparent().get("name") == (
+                        "localhost.localdomain"
+                    )
+                continue
+
+            if in_dg and tuple(path) == dg_path:
+                yield elem.get("name"), elem
+                in_dg = False
+            path.pop()
+            if in_dg:
+                continue  # Still inside a device group, keep it whole for now
+
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    except XMLSyntaxError as exc:
         print(exc)
-        print(dir(exc))
         print("\nInvalid XML File...try again! Our best guess is up there ^^^\n")
         sys.exit(1)
+    except (OSError, EOFError, lzma.LZMAError, tarfile.TarError) as exc:
+        print(exc)
+        print("\nUnable to read/decompress the config file..corrupt?\n")
+        sys.exit(1)
+
+
+async def get_objects_config(config: etree._Element, deep=None) -> Dict:
+    """
+    Get objects from an already parsed config (xml file or Panorama export)
 
+    Args:
+        config: <config> element
+        deep: deep search or not
+
+    Returns:
+         Dict/list of objects
+    """
     # Get device groups and compare/merge with settings.py
     await set_device_groups(config=config, deep=deep)
 
     # Get objects - build into x[type][device-group][name1,name2,...]
+    locations = index_config(config)
     my_objs = {}
     for object_type in settings.TO_DEDUPE:
         my_objs[object_type] = {}
         for dg in settings.DEVICE_GROUPS:
-            object_xpath = None
-            if object_type == "addresses":
-                object_xpath = f"./devices/entry[@name='localhost.localdomain']/device-group/entry[@name='{dg}']/address/entry"
-            if object_type == "address-groups":
-                object_xpath = f"./devices/entry[@name='localhost.localdomain']/device-group/entry[@name='{dg}']/address-group/entry"
-            if object_type == "services":
-                object_xpath = f"./devices/entry[@name='localhost.localdomain']/device-group/entry[@name='{dg}']/service/entry"
-            if object_type == "service-groups":
-                object_xpath = f"./devices/entry[@name='localhost.localdomain']/device-group/entry[@name='{dg}']/service-group/entry"
-
             # Get object
-            objs = config.xpath(object_xpath)
+            objs = location_entries(locations.get(dg), object_type)
 
             if not objs:
                 print(f"No {object_type} found in {dg}, moving on...")
@@ -943,151 +1919,490 @@ async def get_objects_xml(configstr, obj_type=None, deep=None) -> Dict:
     return my_objs
 
 
-#
-# def get_sec_rules_xml(configstr: str, object_type: str) -> Set:
-#     """
-#     Get objects from xml file instead of Panorama
-#
-#     Args:
-#         configstr: xml filename
-#         deep: deep search or not
-#     Returns:
-#          Dict/list of objects
-#     Raises:
-#         N/A
-#     """
-#     try:
-#         config = etree.fromstring(configstr)
-#     except XMLSyntaxError as exc:
-#         print(exc)
-#         print("\nInvalid XML File...try again! Our best guess is up there ^^^\n")
-#         sys.exit(1)
-#
-#     try:
-#         config.xpath("./devices/entry[@name='localhost.localdomain']/device-group")
-#     except XPathEvalError as exc:
-#         print(exc)
-#         print(dir(exc))
-#         print("\nInvalid XML File...try again! Our best guess is up there ^^^\n")
-#         sys.exit(1)
-#
-#     # Get device groups and compare/merge with settings.py
-#     #await set_device_groups(config=config, deep=deep)
-#
-#     # Get Security Rules
-#     dg = "All-Devices"
-#     object_xpath = None
-#     if object_type == "pre":
-#         object_xpath = f"./devices/entry[@name='localhost.localdomain']/device-group/entry[@name='{dg}']/pre-rulebase/security/rules/entry"
-#     if object_type == "post":
-#         object_xpath = f"./devices/entry[@name='localhost.localdomain']/device-group/entry[@name='{dg}']/post-rulebase/security/rules/entry"
-#
-#     # Get object
-#     objs = config.xpath(object_xpath)
-#
-#     if not objs:
-#         print(f"No {object_type} found in {dg}, moving on...")
-#         my_objs = set([])
-#
-#     else:
-#         my_objs = objs
-#
-#     return my_objs
-
-
-def find_duplicates(my_objects):
+def get_full_objects_config(
+    config: etree._Element, device_groups: List[str], object_types: List[str]
+) -> Dict:
+    """
+    Get full objects from a parsed config, in the same format as the API gives us
+
+    Args:
+        config: <config> element
+        device_groups: device groups (or 'shared') to get objects from
+        object_types: object types to get
+
+    Returns:
+        Dict of {object_type: {device-group: [objects]}}
+    """
+    locations = index_config(config)
+    my_objs = {}
+    for object_type in object_types:
+        my_objs[object_type] = {}
+        for dg in device_groups:
+            my_objs[object_type][dg] = [
+                xml_to_dict(entry)
+                for entry in location_entries(locations.get(dg), object_type)
+            ]
+
+    return my_objs
+
+
+def get_names_config(
+    config: etree._Element, device_groups: List[str], object_types: List[str]
+) -> Dict:
+    """
+    Get object names from a parsed config
+
+    Args:
+        config: <config> element
+        device_groups: device groups (or 'shared') to get names from
+        object_types: object types to get
+
+    Returns:
+        Dict of {object_type: {device-group: set of names}}
+    """
+    locations = index_config(config)
+    my_objs = {}
+    for object_type in object_types:
+        my_objs[object_type] = {}
+        for dg in device_groups:
+            my_objs[object_type][dg] = {
+                entry.get("name")
+                for entry in location_entries(locations.get(dg), object_type)
+            }
+
+    return my_objs
+
+
+def index_config(config: etree._Element) -> Dict[str, etree._Element]:
+    """
+    Find every device group (and shared) in one pass over the config
+
+    Args:
+        config: <config> element
+
+    Returns:
+        Dict of {device-group name (or 'shared'): element holding its objects/rules}
+    """
+    locations = {dg.get("name"): dg for dg in CONFIG_DEVICE_GROUPS(config)}
+    shared = config.find("shared")
+    if shared is not None:
+        locations["shared"] = shared
+    return locations
+
+
+def location_entries(
+    location: Union[None, etree._Element], object_type: str
+) -> List[etree._Element]:
+    """
+    Entries of an object type (or security rulebase) in a device group/shared
+
+    Args:
+        location: device group <entry> or <shared> element (None if it doesn't exist)
+        object_type: addresses/address-groups/services/service-groups/tags/
+            secrules-pre/secrules-post
+
+    Returns:
+        list of <entry> elements
+    """
+    find_entries = LOCATION_ENTRIES.get(object_type)
+    if find_entries is None:
+        print(f"Unsupported object type {object_type}")
+        sys.exit()
+    if location is None:
+        return []
+    return find_entries(location)
+
+
+def xml_to_dict(entry: etree._Element) -> Dict:
+    """
+    Convert an xml object <entry> into the dict format the API uses
+
+    Args:
+        entry: <entry> element
+
+    Returns:
+        Dict of the object ('member' is always a list)
+    """
+    return xmltodict.parse(etree.tostring(entry), force_list=("member",))["entry"]
+
+
+class DeviceGroupIds:
+    """
+    Device group name <-> integer id
+
+    A set of device groups can be one int (bit n set = device group n).
+    """
+
+    __slots__ = ("names", "ids")
+
+    def __init__(self, device_groups: List[str]):
+        """
+        Initialize the index
+
+        Args:
+            device_groups: all device groups, in the order results should use
+        """
+        self.names = [sys.intern(dg) for dg in device_groups]
+        self.ids = {dg: dg_id for dg_id, dg in enumerate(self.names)}
+
+    def bit(self, device_group: str) -> int:
+        """Bitset with just this device group"""
+        return 1 << self.ids[device_group]
+
+    def to_names(self, bitset: int) -> List[str]:
+        """Device group names in a bitset, in device group order"""
+        names = []
+        while bitset:
+            low = bitset & -bitset
+            names.append(self.names[low.bit_length() - 1])
+            bitset ^= low
+        return names
+
+    @staticmethod
+    def count(bitset: int) -> int:
+        """Count the device groups in a bitset"""
+        return bin(bitset).count("1")
+
+    @staticmethod
+    def first(bitset: int) -> int:
+        """Id of the first device group in a bitset"""
+        return (bitset & -bitset).bit_length() - 1
+
+
+class ObjectIndex:
+    """
+    Object name -> device groups index
+
+    Built up one device group at a time, in any order. Names are interned and each name's device groups are a bitset, names are only
+    put back together with device group names for the duplicates.
+    """
+
+    def __init__(self, device_groups: List[str]):
+        """
+        Initialize the index
+
+        Args:
+            device_groups: all device groups, in the order results should use
+        """
+        self.device_groups = DeviceGroupIds(device_groups)
+        self.index = {}  # {name: device group bitset}
+
+    def add(self, device_group: str, names) -> None:
+        """
+        Add a device group's object names
+
+        Args:
+            device_group: device group
+            names: object names
+        """
+        bit = self.device_groups.bit(device_group)
+        index = self.index
+        intern = sys.intern
+        for name in names:
+            name = intern(name)
+            index[name] = index.get(name, 0) | bit
+
+    def duplicates(self, minimum: int = 2) -> Dict[str, List[str]]:
+        """
+        Get the duplicate names
+
+        Args:
+            minimum: only names in at least this many device groups (and always
+                more than one)
+
+        Returns:
+            Dict of {name: [device-groups]} for the duplicate names, sorted by name
+        """
+        minimum = max(minimum, 2)
+        count = DeviceGroupIds.count
+        to_names = self.device_groups.to_names
+        lists = {}  # Names with the same device groups share one list
+        duplicates = {}
+        for name, bitset in sorted(self.index.items()):
+            if count(bitset) >= minimum:
+                dgs = lists.get(bitset)
+                if dgs is None:
+                    dgs = lists[bitset] = to_names(bitset)
+                duplicates[name] = dgs
+        return duplicates
+
+
+def find_duplicates(my_objects, minimum: int = 2):
     """
     Finds the duplicate objects (multiple device groups contain the object)
 
     Args:
      my_objects: list of objects to search through
+     minimum: only objects in at least this many device groups
     Returns:
         duplicates: Dict of duplicate object names containing list of device-groups]
     Raises:
         N/A
     """
-    duplicates = {}
-    for items in combinations(my_objects, r=2):
-        dg1 = items[0]
-        dg2 = items[1]
+    index = ObjectIndex(list(my_objects))
+    for dg, names in my_objects.items():
+        index.add(dg, names)
 
-        dupes = my_objects[dg1].intersection(my_objects[dg2])
+    # Sorted by name so output (and duplicates.json) is the same run to run
+    return index.duplicates(minimum=minimum)
 
-        for obj in dupes:
-            if duplicates.get(obj):
-                if dg1 not in duplicates[obj]:
-                    duplicates[obj].append(dg1)
-                if dg2 not in duplicates[obj]:
-                    duplicates[obj].append(dg2)
-            else:
-                duplicates[obj] = list(items)
 
-    return duplicates
+def canonicalize_object(obj: Any) -> Any:
+    """
+    Canonical form of an object for deep comparison
+
+    Location keys are dropped from the top level and every list is sorted, so two
+    objects that DeepDiff(ignore_order=True) would call equal canonicalize the same.
+
+    Args:
+        obj: object (dict) as returned by the API or xmltodict
+
+    Returns:
+        Canonical copy of the object
+    """
+
+    def _canonical(value):
+        if isinstance(value, dict):
+            return {k: _canonical(v) for k, v in value.items()}
+        if isinstance(value, list):
+            items = [_canonical(v) for v in value]
+            return sorted(items, key=lambda v: json.dumps(v, sort_keys=True))
+        return value
+
+    return {k: _canonical(v) for k, v in obj.items() if k not in DEEP_IGNORE_KEYS}
 
 
-def find_duplicates_deep(my_objects, xml: Union[None, str]):
+def object_digest(canonical_obj: Dict) -> str:
+    """
+    Stable content hash of a canonicalized object
+
+    Args:
+        canonical_obj: output of canonicalize_object()
+
+    Returns:
+        hex digest
+    """
+    dumped = json.dumps(canonical_obj, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(dumped.encode("utf8")).hexdigest()
+
+
+def find_duplicates_deep(
+    my_objects, xml: Union[None, str], explain: bool = False, minimum: int = 2
+):
     """
     Finds the duplicate objects (multiple device groups contain the object)
 
+    Each object is canonicalized and hashed once, then bucketed by (name, hash).
+    The biggest bucket for a name is the duplicate, any other bucket for the same
+    name is reported as an 'almost' duplicate.
+
     Args:
         my_objects: list of objects to search through
         xml: are we parsing xml or not?
+        explain: include a field-level DeepDiff for each almost-duplicate
+        minimum: only duplicates in at least this many device groups
     Returns:
         duplicates: Dict of duplicate object names containing list of device-groups]
+        diffs: List of almost-duplicates [[variant1, variant2(, diff)], ...]
     Raises:
         N/A
     """
-    duplicates = {}
-    diffs = []
-    nametag = "name" if xml else "@name"
-    for items in combinations(my_objects, r=2):
-        dg1 = items[0]
-        dg2 = items[1]
-        for obj1 in my_objects[dg1]:
-            for obj2 in my_objects[dg2]:
-                # We are now comparing two lists of objects
-                if obj1 is not None and obj2 is not None:
-                    if obj1.get(nametag) == obj2.get(nametag):
-                        dupe_name = obj1.get(nametag)
-                        if xml:  # Convert to Dict so we can use Deep Diff
-                            dupe_obj1 = xmltodict.parse(etree.tostring(obj1))["entry"]
-                            dupe_obj2 = xmltodict.parse(etree.tostring(obj2))["entry"]
-                        else:
-                            dupe_obj1 = obj1
-                            dupe_obj2 = obj2
-
-                        # Don't need these keys, will cause dupe checking issues too
-                        for key in ("@loc", "@location", "@device-group", "@overrides"):
-                            if dupe_obj1.get(key):
-                                dupe_obj1.pop(key)
-                            if dupe_obj2.get(key):
-                                dupe_obj2.pop(key)
-
-                        # Deep Diff!
-                        diff = DeepDiff(dupe_obj1, dupe_obj2, ignore_order=True)
-                        if not diff:
-                            # We have a dupe! Add the dupe & device-groups to our list
-                            if dupe_name is None:
-                                print("how did this happen??")
-                            else:
-                                if duplicates.get(dupe_name):
-                                    if dg1 not in duplicates[dupe_name]:
-                                        duplicates[dupe_name].append(dg1)
-                                    if dg2 not in duplicates[dupe_name]:
-                                        duplicates[dupe_name].append(dg2)
-                                else:
-                                    duplicates[dupe_name] = list(items)
-                        else:
-                            # weirdness required due to json.dumps("@blah"), to be betterized
-                            temp1 = {"@device-group": dg1}
-                            temp2 = {"@device-group": dg2}
-                            temp1.update(dupe_obj1)
-                            temp2.update(dupe_obj2)
-                            diffs.append([temp1, temp2])
-                            # print(
-                            #     f"Deep check found {temp1.get('@name')} in {temp1.get('@device-group')} and {temp2.get('@name')} in {temp2.get('@device-group')}"
-                            # )
-    return duplicates, diffs
+    index = DeepIndex(list(my_objects), xml=bool(xml))
+    for dg, objs in my_objects.items():
+        index.add(dg, objs)
+
+    return index.duplicates(explain=explain, minimum=minimum)
+
+
+class Variant:
+    """One version (content hash) of an object name, and where it's found"""
+
+    __slots__ = ("sample", "device_groups")
+
+    def __init__(self, sample: Dict):
+        """
+        Initialize a version of an object
+
+        Args:
+            sample: canonical object
+        """
+        self.sample = sample
+        self.device_groups = 0  # device group bitset
+
+
+class DeepIndex:
+    """
+    (name, content hash) -> device groups index for deep dedupe
+
+    Built up one device group at a time, in any order.
+    """
+
+    def __init__(self, device_groups: List[str], xml: bool = False):
+        """
+        Initialize the index
+
+        Args:
+            device_groups: all device groups, in the order results should use
+            xml: objects are xml elements (instead of dicts)
+        """
+        self.device_groups = DeviceGroupIds(device_groups)
+        self.xml = xml
+        self.buckets = {}  # {name: {digest: Variant}}
+
+    def add(self, device_group: str, objs, kept: "KeptObjects" = None) -> None:
+        """
+        Add a device group's objects
+
+        Args:
+            device_group: device group
+            objs: objects (dicts, or xml elements)
+            kept: also keep the objects here (per version), for the push
+        """
+        nametag = "name" if self.xml else "@name"
+        bit = self.device_groups.bit(device_group)
+        buckets = self.buckets
+        for obj in objs:
+            if obj is None:
+                continue
+            name = obj.get(nametag)
+            if name is None:
+                print("how did this happen??")
+                continue
+            if self.xml:  # Convert to Dict so it looks like what the API gives us
+                obj = xml_to_dict(obj)
+
+            canonical_obj = canonicalize_object(obj)
+            digest = object_digest(canonical_obj)
+            variants = buckets.get(name)
+            if variants is None:
+                variants = buckets[sys.intern(name)] = {}
+            variant = variants.get(digest)
+            if variant is None:
+                variant = variants[digest] = Variant(canonical_obj)
+            variant.device_groups |= bit
+            if kept is not None:
+                kept.add(device_group, obj, digest)
+
+    def duplicates(self, explain: bool = False, minimum: int = 2):
+        """
+        Get the duplicates and almost-duplicates
+
+        Args:
+            explain: include a field-level DeepDiff for each almost-duplicate
+            minimum: only duplicates in at least this many device groups (and
+                always more than one), almost-duplicates are always reported
+
+        Returns:
+            duplicates: Dict of duplicate object names containing list of device-groups]
+            diffs: List of almost-duplicates [[variant1, variant2(, diff)], ...]
+        """
+        minimum = max(minimum, 2)
+        count = DeviceGroupIds.count
+        first = DeviceGroupIds.first
+        to_names = self.device_groups.to_names
+        duplicates = {}
+        diffs = []
+        for name, variants in sorted(self.buckets.items()):
+            # Ordered by 1st device group, so ties/output don't depend on arrival order
+            variants = sorted(
+                variants.values(), key=lambda variant: first(variant.device_groups)
+            )
+            # Most common version wins, first one found if it's a tie
+            primary = max(variants, key=lambda variant: count(variant.device_groups))
+            if count(primary.device_groups) >= minimum:
+                duplicates[name] = to_names(primary.device_groups)
+
+            for variant in variants:
+                if variant is primary:
+                    continue
+                # weirdness required due to json.dumps("@blah"), to be betterized
+                temp1 = {"@device-group": to_names(primary.device_groups)}
+                temp2 = {"@device-group": to_names(variant.device_groups)}
+                temp1.update(primary.sample)
+                temp2.update(variant.sample)
+                diff = [temp1, temp2]
+                if explain:
+                    diff.append(
+                        json.loads(
+                            DeepDiff(
+                                primary.sample,
+                                variant.sample,
+                                ignore_order=True,
+                            ).to_json()
+                        )
+                    )
+                diffs.append(diff)
+
+        return duplicates, diffs
+
+
+class KeptObjects:
+    """
+    Full objects kept from the duplicate search, for the push
+
+    Only one full object per name (per version, deep) is kept, the one from the
+    first device group, which is what gets cloned into the parent. Every other
+    device group only keeps what its copy refers to (tags, group members), which
+    is all the deletes need.
+    """
+
+    __slots__ = ("device_groups", "payloads", "refs")
+
+    def __init__(self, device_groups: List[str]):
+        """
+        Initialize the index
+
+        Args:
+            device_groups: all device groups, in the order results should use
+        """
+        self.device_groups = DeviceGroupIds(device_groups)
+        self.payloads = {}  # {name: {digest: (device group id, object)}}
+        self.refs = {}  # {(device-group, name): {tag/static/members}}
+
+    def add(self, device_group: str, obj: Dict, digest: str = None) -> None:
+        """
+        Keep an object
+
+        Args:
+            device_group: device group
+            obj: full object
+            digest: object version (deep), None when only names are compared
+        """
+        name = sys.intern(obj["@name"])
+        dg_id = self.device_groups.ids[device_group]
+        variants = self.payloads.setdefault(name, {})
+        kept = variants.get(digest)
+        if kept is None or dg_id < kept[0]:
+            variants[digest] = (dg_id, obj)
+        refs = {key: obj[key] for key in REFERENCE_KEYS if obj.get(key)}
+        if refs:
+            self.refs[(device_group, name)] = refs
+
+    def objects(self, duplicates: Dict[str, List[str]]) -> Dict[str, List[Dict]]:
+        """
+        Objects for the duplicates, everything else is dropped
+
+        Args:
+            duplicates: Dict of {name: [device-groups]}
+
+        Returns:
+            Dict of {device-group: [objects]}, the full object in the 1st device
+            group of each duplicate, just its name and references in the others
+        """
+        ids = self.device_groups.ids
+        objs = {dg: [] for dg in self.device_groups.names}
+        for name, dgs in duplicates.items():
+            first = ids[dgs[0]]
+            for dg_id, obj in self.payloads.get(name, {}).values():
+                if dg_id == first:
+                    objs[dgs[0]].append(obj)
+                    break
+            for dg in dgs[1:]:
+                objs[dg].append({"@name": name, **self.refs.get((dg, name), {})})
+
+        self.payloads = {}
+        self.refs = {}
+        return objs
 
 
 def find_duplicates_shared(shared_objs, dupes) -> Dict[str, List]:
@@ -1103,17 +2418,51 @@ def find_duplicates_shared(shared_objs, dupes) -> Dict[str, List]:
     """
 
     shared_duplicates = {}
-    for object_type in dupes:
-        shared_duplicates[object_type] = []
-        for obj_name in dupes[object_type]:
-            if obj_name in shared_objs[object_type]["shared"]:
-                # print(f"\n\tFound duplicate in shared: {obj_name}")
-                shared_duplicates[object_type].append(obj_name)
+    for object_type, duplicates in dupes.items():
+        # Duplicates are already deduped/filtered, only the names matter here
+        index = ObjectIndex(["shared", "duplicates"])
+        index.add("shared", shared_objs[object_type]["shared"])
+        index.add("duplicates", duplicates)
+        both = index.device_groups.bit("shared") | index.device_groups.bit("duplicates")
+        shared_duplicates[object_type] = [
+            obj_name for obj_name in duplicates if index.index[obj_name] == both
+        ]
 
     return shared_duplicates
 
 
-def find_object(objs_list, object_type, device_group, name):
+def index_objects(objs_list) -> Dict[Tuple[str, str, str], Dict]:
+    """
+    Index full objects by (object type, device group, name)
+
+    Args:
+        objs_list: Dict of objects {object_type: {device-group: [objects]}}
+
+    Returns:
+        Dict of {(object_type, device-group, name): object}, 1st one found wins
+    """
+    index = {}
+    for object_type, device_groups in objs_list.items():
+        for device_group, objs in device_groups.items():
+            for obj in objs:
+                if not obj:
+                    continue
+                try:
+                    key = (object_type, device_group, obj.get("@name"))
+                except AttributeError:
+                    message = f"""
+                        Error indexing objects list, exiting due to major malfunction.
+                        obj == {obj}
+                    """
+                    logger.error(message)
+                    print(message)
+                    sys.exit(1)
+                index.setdefault(key, obj)
+
+    return index
+
+
+def find_object(objs_list, object_type, device_group, name, index=None):
     """
     Find object to be used for creation in parent device group
 
@@ -1122,11 +2471,16 @@ def find_object(objs_list, object_type, device_group, name):
         object_type:    address/group/services/groups
         device_group:  device group
         name:   name of object to find
+        index:  index_objects(objs_list), if there is one (no searching)
+
     Returns:
          The object you were looking for
+
     Raises:
         N/A
     """
+    if index is not None:
+        return index.get((object_type, device_group, name))
 
     for obj in objs_list[object_type][device_group]:
         if obj:
@@ -1145,88 +2499,6 @@ def find_object(objs_list, object_type, device_group, name):
     return None
 
 
-async def do_the_creates(
-    pan: PanoramaApi,
-    results: Dict,
-    object_types: List[str],
-    objs_list: Any,
-    set_output: bool,
-) -> Union[None, Tuple]:
-    """
-    Create the objects
-
-    Args:
-        pan: PanoramaApi object
-        results: objects (duplicates) to be created (as part of 'move')
-        object_types: object types to be created (used to create objects before groups)
-        objs_list: full object values so that we can clone them
-        set_output: set commands or not?
-
-    """
-    coroutines = []
-    limit = asyncio.Semaphore(value=settings.MAX_CONCURRENT)
-    for object_type in object_types:
-        if results.get(object_type):
-            for dupe, device_groups in results[object_type].items():
-
-                # Get full object
-                dupe_obj = find_object(
-                    objs_list=objs_list,
-                    object_type=object_type,
-                    device_group=device_groups[
-                        0
-                    ],  # just grab the object from the 1st dg
-                    name=dupe,
-                )
-
-                # Create it
-                coroutines.append(
-                    pan.create_object(
-                        limit=limit,
-                        object_type=object_type,
-                        obj=dupe_obj,
-                        device_group=settings.NEW_PARENT_DEVICE_GROUP,
-                        set_output=set_output,
-                    )
-                )
-
-    return await asyncio.gather(*coroutines)
-
-
-async def do_the_deletes(
-    pan: PanoramaApi, results: Dict, object_types: List[str], set_output: bool
-) -> Union[None, Tuple]:
-    """
-    Delete the objects
-
-    Args:
-        pan: PanoramaApi object
-        results: objects (duplicates) to be deleted
-        object_types: object types to be deleted (used to send groups in before objects)
-        set_output: set commands or not?
-
-    """
-    limit = asyncio.Semaphore(value=settings.MAX_CONCURRENT)
-    coroutines = []
-    for object_type in object_types:
-        if results.get(object_type):
-            for dupe, device_groups in results[object_type].items():
-                for group in device_groups:
-                    if group in settings.NEW_PARENT_DEVICE_GROUP:  # do this better?
-                        continue
-                    coroutines.append(
-                        pan.delete_object(
-                            limit=limit,
-                            object_type=object_type,
-                            name=dupe,
-                            device_group=group,
-                            set_output=set_output,
-                        )
-                    )
-
-    return await asyncio.gather(*coroutines)
-
-
 async def do_the_deletes_shared(
     pan: PanoramaApi, objects: Dict, object_types: List[str], set_output: bool
 ) -> Union[None, Tuple]:
@@ -1239,15 +2511,21 @@ async def do_the_deletes_shared(
         object_types: object types to be deleted (used to send groups in before objects)
         set_output: set commands or not?
     """
-    limit = asyncio.Semaphore(value=settings.MAX_CONCURRENT)
     coroutines = []
     params = {"location": "shared"}
+    if not set_output:
+        deletes = [
+            (object_type, "shared", dupe)
+            for object_type in object_types
+            for dupe in objects.get(object_type, [])
+        ]
+        return await pan.delete_objects(deletes=deletes, batch_size=settings.BATCH_SIZE)
+
     for object_type in object_types:
         if objects.get(object_type):
             for dupe in objects[object_type]:
                 coroutines.append(
                     pan.delete_object(
-                        limit=limit,
                         object_type=object_type,
                         name=dupe,
                         params=params,
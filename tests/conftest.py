@@ -0,0 +1,27 @@
+import pytest
+
+import pan_deduper.utils as utils
+
+
+@pytest.fixture
+def dedupe_settings(monkeypatch, tmp_path):
+    """
+    settings.py for a test: every device group, nothing excluded, no parent,
+    addresses only, no caches. Anything set on it is put back after the test.
+    """
+    monkeypatch.setattr("builtins.input", lambda _: "Yes")
+    defaults = {
+        "DEVICE_GROUPS": [],
+        "EXCLUDE_DEVICE_GROUPS": [],
+        "NEW_PARENT_DEVICE_GROUP": [],
+        "CLEANUP_DGS": [],
+        "TO_DEDUPE": ["addresses"],
+        "MINIMUM_DUPLICATES": 2,
+        "RESPONSE_CACHE": False,
+        "SNAPSHOT_CACHE": False,
+        "CACHE_DIR": str(tmp_path / "cache"),
+        "WORKERS": 0,
+    }
+    for setting, value in defaults.items():
+        monkeypatch.setattr(utils.settings, setting, value)
+    return utils.settings
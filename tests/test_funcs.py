@@ -1,7 +1,13 @@
+import asyncio
+import random
+from itertools import combinations
+
 import pytest
+from lxml import etree
 
 import pan_deduper.settings as settings
 import pan_deduper.utils as utils
+from pan_deduper.scheduler import Scheduler
 
 
 def test_format_objs_names_only():
@@ -96,6 +102,148 @@ def test_check_sec_rules():
     assert cmds == correct_cmds
 
 
+def check_sec_rules_pairwise(rules):
+    """The original rule-by-rule comparison (without tags), for reference"""
+    rule_updates = {}
+    for i1, rule1 in enumerate(rules):
+        if rule1["@loc"] != rule1["@device-group"]:
+            continue
+        for rule2 in rules[i1:]:
+            if rule1["@name"] == rule2["@name"]:
+                continue
+            if rule2["action"] == "deny" and rule1["action"] != "deny":
+                break
+            if rule2["@loc"] != rule2["@device-group"]:
+                continue
+            if all(
+                set(rule1[field]["member"]) == set(rule2[field]["member"])
+                for field in ("from", "destination", "service", "application")
+            ) and (rule1["action"] == rule2["action"]):
+                rule_updates.setdefault(rule1["@name"], {"rules": []})
+                rule_updates[rule1["@name"]]["rules"].append(rule2)
+    return rule_updates
+
+
+def test_check_sec_rules_matches_pairwise():
+    rng = random.Random(7)
+    rules = []
+    for i in range(300):
+        rules.append(
+            {
+                "@name": f"rule{i}",
+                "action": rng.choice(["allow", "allow", "allow", "deny", "drop"]),
+                "from": {"member": rng.sample(["inside", "dmz"], rng.randint(1, 2))},
+                "source": {"member": [f"10.0.0.{i}/32"]},
+                "destination": {"member": [rng.choice(["9.9.9.9/32", "any"])]},
+                "@loc": "dg" if rng.random() > 0.1 else "parent",
+                "@device-group": "dg",
+                "service": {"member": [rng.choice(["tcp-443", "udp-53"])]},
+                "application": {"member": ["any"]},
+            }
+        )
+
+    expected = utils.create_set_rule_output(check_sec_rules_pairwise(rules), "pre")
+    cmds = utils.create_set_rule_output(utils.check_sec_rules(rules), "pre")
+    assert cmds == expected
+    assert len(cmds) > 100
+
+
+def test_find_shadowed_rules():
+    def rule(name, action="allow", loc="dg", **fields):
+        rule = {"@name": name, "action": action, "@loc": loc, "@device-group": "dg"}
+        for field in ("from", "to", "source", "destination", "service"):
+            rule[field] = {"member": fields.get(field, ["any"])}
+        rule["application"] = {"member": fields.get("application", ["ssl"])}
+        return rule
+
+    pre = [rule("parent-deny", "deny", loc="parent", destination=["1.1.1.1"])]
+    rules = [
+        rule("web", source=["10.0.0.0/8", "dmz-net"], service=["tcp-443"]),
+        rule("web-narrow", "deny", source=["10.0.0.0/8"], service=["tcp-443"]),
+        rule("web-other", source=["10.0.0.0/8"], service=["tcp-80"]),
+        rule("to-1111", destination=["1.1.1.1"], source=["10.0.0.0/8"]),
+        rule("anyapp", source=["dmz-net"], application=["any"]),
+    ]
+    shadowed = utils.find_shadowed_rules(rules, earlier=pre)
+    assert [(r["@name"], s["@name"]) for r, s in shadowed] == [
+        ("web-narrow", "web"),
+        ("to-1111", "parent-deny"),
+    ]
+    assert utils.create_shadowed_rule_output(shadowed, "post")[1] == (
+        "post-rulebase 'to-1111' (allow) can never match, "
+        "'parent-deny' (deny) in parent covers it"
+    )
+
+    # Same answer as checking every pair
+    rng = random.Random(3)
+    fields = [field for field in utils.SHADOW_FIELDS if field != "target"]
+    rules = []
+    for i in range(200):
+        rules.append(
+            {
+                "@name": f"rule{i}",
+                "action": "allow",
+                "@loc": "dg",
+                "@device-group": "dg",
+                **{
+                    field: {
+                        "member": rng.choice(
+                            [["any"], ["a"], ["b"], ["a", "b"], ["a", "c"]]
+                        )
+                    }
+                    for field in fields
+                },
+            }
+        )
+
+    def covers(rule1, rule2):
+        return all(
+            "any" in rule1[f]["member"]
+            or set(rule2[f]["member"]) <= set(rule1[f]["member"])
+            and "any" not in rule2[f]["member"]
+            for f in fields
+        )
+
+    expected = []
+    for i, rule2 in enumerate(rules):
+        for rule1 in rules[:i]:
+            if covers(rule1, rule2):
+                expected.append((rule2["@name"], rule1["@name"]))
+                break
+    shadowed = utils.find_shadowed_rules(rules)
+    assert [(r["@name"], s["@name"]) for r, s in shadowed] == expected
+    assert expected
+
+
+def test_find_shadowed_rules_limits():
+    def rule(name, **fields):
+        rule = {"@name": name, "action": "allow", "@loc": "dg", "@device-group": "dg"}
+        rule.update(fields)
+        return rule
+
+    def target(*serials, negate="no"):
+        devices = {"entry": [{"@name": serial} for serial in serials]}
+        return {"devices": devices if serials else None, "negate": negate}
+
+    rules = [
+        rule("fw1-only", target=target("001")),
+        rule("fw1-again", target=target("001")),
+        rule("all-fws", target=target()),
+        rule("all-again"),
+        rule("business-hours", schedule="9to5"),
+        rule("hip-checked", **{"source-hip": {"member": ["patched"]}}),
+        rule("not-fw2", target=target("002", negate="yes")),
+    ]
+    shadowed = utils.find_shadowed_rules(rules)
+    # Rules limited to devices/a schedule/HIP profiles don't cover broader rules
+    assert [(r["@name"], s["@name"]) for r, s in shadowed] == [
+        ("fw1-again", "fw1-only"),
+        ("all-again", "all-fws"),
+        ("business-hours", "all-fws"),
+        ("hip-checked", "all-fws"),
+    ]
+
+
 def test_bunch_commands():
     test_set_commands = {
         "tags": [
@@ -245,6 +393,380 @@ def test_find_object():
     assert error.value.code == 1
 
 
+def test_find_object_index():
+    objs_list = {
+        "addresses": {
+            "dg1": [
+                None,
+                {"ip-netmask": "10.1.1.0/24", "@name": "testobj"},
+                {"ip-netmask": "10.2.2.0/24", "@name": "testobj"},
+            ],
+            "dg2": [{"ip-netmask": "nope", "@name": "other"}],
+        },
+        "services": {"dg1": [{"@name": "testobj", "protocol": {}}]},
+    }
+    index = utils.index_objects(objs_list)
+    assert len(index) == 3
+
+    for object_type, dg, name in [
+        ("addresses", "dg1", "testobj"),
+        ("addresses", "dg2", "other"),
+        ("services", "dg1", "testobj"),
+        ("addresses", "dg2", "testobj"),
+    ]:
+        assert utils.find_object(
+            objs_list, object_type, dg, name, index=index
+        ) == utils.find_object(objs_list, object_type, dg, name)
+
+    with pytest.raises(SystemExit) as error:
+        utils.index_objects({"addresses": {"dg1": ["testobj"]}})
+    assert error.value.code == 1
+
+
+def find_duplicates_pairwise(my_objects):
+    """Original pairwise implementation, kept as a reference for find_duplicates"""
+    duplicates = {}
+    for items in combinations(my_objects, r=2):
+        dg1 = items[0]
+        dg2 = items[1]
+
+        dupes = my_objects[dg1].intersection(my_objects[dg2])
+
+        for obj in dupes:
+            if duplicates.get(obj):
+                if dg1 not in duplicates[obj]:
+                    duplicates[obj].append(dg1)
+                if dg2 not in duplicates[obj]:
+                    duplicates[obj].append(dg2)
+            else:
+                duplicates[obj] = list(items)
+
+    return duplicates
+
+
+def test_find_duplicates_matches_pairwise():
+    rand = random.Random(1234)
+    names = [f"obj{i}" for i in range(300)]
+    my_objects = {
+        f"dg{i}": set(rand.sample(names, rand.randint(0, 60))) for i in range(40)
+    }
+    my_objects["empty"] = set()
+
+    duplicates = utils.find_duplicates(my_objects)
+    assert duplicates == find_duplicates_pairwise(my_objects)
+    assert list(duplicates) == sorted(duplicates)
+
+
+def test_find_duplicates_minimum():
+    my_objects = {
+        "dg1": {"a", "b", "c"},
+        "dg2": {"a", "b"},
+        "dg3": {"a", "d"},
+        "dg4": {"d"},
+    }
+    assert utils.find_duplicates(my_objects) == {
+        "a": ["dg1", "dg2", "dg3"],
+        "b": ["dg1", "dg2"],
+        "d": ["dg3", "dg4"],
+    }
+    assert utils.find_duplicates(my_objects, minimum=3) == {"a": ["dg1", "dg2", "dg3"]}
+    # Always a duplicate, never just one device group
+    assert utils.find_duplicates(my_objects, minimum=1) == utils.find_duplicates(
+        my_objects
+    )
+
+    shared = {"addresses": {"shared": ["b", "d", "x"]}}
+    dupes = {"addresses": utils.find_duplicates(my_objects)}
+    assert utils.find_duplicates_shared(shared, dupes) == {"addresses": ["b", "d"]}
+
+
+def test_device_group_ids():
+    dgs = utils.DeviceGroupIds([f"dg{i}" for i in range(100)])
+    bitset = dgs.bit("dg99") | dgs.bit("dg3") | dgs.bit("dg64")
+    assert dgs.to_names(bitset) == ["dg3", "dg64", "dg99"]
+    assert dgs.count(bitset) == 3
+    assert dgs.first(bitset) == 3
+    assert dgs.to_names(0) == []
+
+
+def test_find_duplicates_deep():
+    grp = {"@name": "grp1", "static": {"member": ["a", "b", "c"]}}
+    my_objects = {
+        "dg1": [dict(grp, **{"@loc": "dg1", "@device-group": "dg1"})],
+        "dg2": [
+            {"@name": "grp1", "@loc": "dg2", "static": {"member": ["c", "a", "b"]}}
+        ],
+        "dg3": [{"@name": "grp1", "static": {"member": ["a", "b"]}}],
+        "dg4": [dict(grp, **{"@overrides": "x"}), {"@name": "lonely"}],
+    }
+    duplicates, diffs = utils.find_duplicates_deep(my_objects, xml=None)
+    assert duplicates == {"grp1": ["dg1", "dg2", "dg4"]}
+    assert utils.find_duplicates_deep(my_objects, xml=None, minimum=4) == ({}, diffs)
+    assert len(diffs) == 1
+    assert diffs[0][0]["@device-group"] == ["dg1", "dg2", "dg4"]
+    assert diffs[0][1]["@device-group"] == ["dg3"]
+    assert len(diffs[0]) == 2
+
+    _, diffs = utils.find_duplicates_deep(my_objects, xml=None, explain=True)
+    assert "iterable_item_removed" in diffs[0][2]
+
+
+def test_find_duplicates_deep_xml():
+    def entry(xml):
+        return etree.fromstring(xml)
+
+    my_objects = {
+        "dg1": {
+            entry("<entry name='svc'><members><member>a</member></members></entry>")
+        },
+        "dg2": {
+            entry("<entry name='svc'><members><member>a</member></members></entry>")
+        },
+    }
+    duplicates, diffs = utils.find_duplicates_deep(my_objects, xml="<config/>")
+    assert duplicates == {"svc": ["dg1", "dg2"]}
+    assert diffs == []
+
+
+class FakePan:
+    """Just enough PanoramaApi to hand out objects and count concurrent requests"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get_objects(self, object_type, device_group=None, params=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        dg = params["device-group"]
+        await asyncio.sleep(random.random() / 100)
+        self.in_flight -= 1
+        if dg == "dg-empty":
+            return None
+        return [{"@name": f"{object_type}-{dg}", "@loc": dg}]
+
+
+@pytest.mark.asyncio
+async def test_get_objects_panorama_concurrent(dedupe_settings):
+    dgs = [f"dg{i}" for i in range(30)] + ["dg-empty"]
+    dedupe_settings.DEVICE_GROUPS = dgs
+    dedupe_settings.TO_DEDUPE = ["addresses", "services"]
+
+    pan = FakePan()
+    my_objs = await utils.get_objects_panorama(pan)
+
+    assert pan.max_in_flight > 1
+    assert list(my_objs["addresses"]) == dgs
+    assert my_objs["services"]["dg3"] == {"services-dg3"}
+    assert my_objs["services"]["dg-empty"] == set()
+
+
+class FakeDupePan(FakePan):
+    """FakePan where every device group also has a 'common' object (2 variants)"""
+
+    async def get_objects(self, object_type, device_group=None, params=None):
+        objs = await super().get_objects(object_type, device_group, params)
+        if objs:
+            dg = params["device-group"]
+            objs.append({"@name": "common", "@loc": dg, "value": int(dg[2:]) % 3 == 0})
+        return objs
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("deep", [False, True])
+async def test_find_duplicates_panorama(dedupe_settings, deep):
+    dgs = [f"dg{i}" for i in range(30)] + ["dg-empty"]
+    dedupe_settings.DEVICE_GROUPS = dgs
+    dedupe_settings.TO_DEDUPE = ["addresses", "services"]
+
+    found, full_objs = await utils.find_duplicates_panorama(FakeDupePan(), deep=deep)
+    assert full_objs is None
+
+    # Same as fetching everything first, then deduping
+    my_objs = await utils.get_objects_panorama(FakeDupePan(), names_only=not deep)
+    for object_type in ("addresses", "services"):
+        if deep:
+            expected = utils.find_duplicates_deep(my_objs[object_type], xml=None)
+        else:
+            expected = (utils.find_duplicates(my_objs[object_type]), None)
+        assert found[object_type] == expected
+    assert list(found["addresses"][0]) == ["common"]
+
+    # Full objects kept for the creates/deletes, same dupes, duplicates only
+    pan = FakeDupePan()
+    kept, full_objs = await utils.find_duplicates_panorama(
+        pan, deep=deep, keep_objects=True
+    )
+    assert kept == found
+    assert list(full_objs["addresses"]) == dgs
+    # The full object only in the 1st device group, just the name in the others
+    first, second, *_ = found["addresses"][0]["common"]
+    value = int(first[2:]) % 3 == 0
+    assert full_objs["addresses"][first] == [
+        {"@name": "common", "@loc": first, "value": value}
+    ]
+    assert full_objs["addresses"][second] == [{"@name": "common"}]
+    assert full_objs["addresses"]["dg-empty"] == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("deep", [False, True])
+async def test_find_duplicates_panorama_no_device_groups(dedupe_settings, deep):
+    dedupe_settings.TO_DEDUPE = ["addresses", "services"]
+
+    found, full_objs = await utils.find_duplicates_panorama(
+        FakeDupePan(), deep=deep, keep_objects=True
+    )
+    diffs = [] if deep else None
+    assert found == {"addresses": ({}, diffs), "services": ({}, diffs)}
+    assert full_objs == {"addresses": {}, "services": {}}
+
+
+def nested_group_objects():
+    """addr1 (tagged) in inner-group, inner-group in outer-group, in dg1 and dg2"""
+    objs = {"addresses": {}, "address-groups": {}}
+    for dg in ("dg1", "dg2"):
+        objs["addresses"][dg] = [
+            {"@name": "addr1", "ip-netmask": "10.0.0.1/32", "tag": {"member": ["t1"]}}
+        ]
+        objs["address-groups"][dg] = [
+            {"@name": "outer-group", "static": {"member": ["inner-group"]}},
+            {"@name": "inner-group", "static": {"member": ["addr1"]}},
+        ]
+    results = {
+        "addresses": {"addr1": ["dg1", "dg2"]},
+        "address-groups": {
+            "outer-group": ["dg1", "dg2"],
+            "inner-group": ["dg1", "dg2"],
+        },
+    }
+    return objs, results
+
+
+def test_build_schedule_nested_groups(dedupe_settings):
+    dedupe_settings.TO_DEDUPE = ["addresses", "address-groups"]
+    dedupe_settings.NEW_PARENT_DEVICE_GROUP = ["parent"]
+    objs, results = nested_group_objects()
+    tags = utils.get_any_tags(objs)
+
+    schedule = utils.build_schedule(
+        results=results, objs_list=objs, tags=tags, full_tags={"t1": {"@name": "t1"}}
+    )
+    order = schedule.order()
+    position = {key: i for i, key in enumerate(order)}
+
+    assert len(order) == 4 + 3 * 2 + 2
+    creates = ["tags", "addresses", "address-groups", "address-groups"]
+    assert [key[1] for key in order[:4]] == creates
+    assert (
+        position[("create", "address-groups", "inner-group")]
+        < position[("create", "address-groups", "outer-group")]
+    )
+    for dg in ("dg1", "dg2"):
+        deletes = [
+            ("delete", "address-groups", dg, "outer-group"),
+            ("delete", "address-groups", dg, "inner-group"),
+            ("delete", "addresses", dg, "addr1"),
+            ("delete", "tags", dg, "t1"),
+        ]
+        assert sorted(deletes, key=position.__getitem__) == deletes
+        assert (
+            position[("create", "address-groups", "outer-group")] < position[deletes[0]]
+        )
+
+
+def test_get_any_tags():
+    objs = {
+        "addresses": {
+            "dg1": [
+                {"@name": "a1", "tag": {"member": ["t1", "t2"]}},
+                {"@name": "a2", "tag": {"member": ["t2", "t1", "t3"]}},
+                {"@name": "a3"},
+            ],
+            "dg2": [{"@name": "a1", "tag": {"member": ["t2"]}}],
+        },
+        "services": {"dg2": [{"@name": "s1", "tag": {"member": ["t4", "t2"]}}]},
+    }
+
+    tags = utils.get_any_tags(objs)
+    assert tags == {"dg1": ["t1", "t2", "t3"], "dg2": ["t2", "t4"]}
+    assert utils.tag_device_groups(tags) == {
+        "t1": ["dg1"],
+        "t2": ["dg1", "dg2"],
+        "t3": ["dg1"],
+        "t4": ["dg2"],
+    }
+
+    with pytest.raises(SystemExit) as error:
+        utils.get_any_tags({"addresses": {"dg1": [{"@name": "a1", "tag": {"x": 1}}]}})
+    assert error.value.code == 1
+
+
+class FakeTagPan:
+    """Just enough PanoramaApi to hand out every tag of a device group"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def get_objects(self, object_type, device_group=None, params=None):
+        dg = params["device-group"]
+        self.requests.append((object_type, dg, params.get("name")))
+        if dg == "dg-broken":
+            return None
+        return [
+            {"@name": f"t{i}", "@loc": dg, "color": f"{dg}-color{i}"} for i in range(3)
+        ]
+
+
+@pytest.mark.asyncio
+async def test_get_full_tags():
+    tags = {"dg1": ["t0", "t1"], "dg2": ["t1", "t2", "nope"], "dg3": ["t0"]}
+    pan = FakeTagPan()
+
+    full_tags = await utils.get_full_tags(tags=tags, pan=pan)
+
+    # One request per device group that's 1st with a tag, not one per tag
+    assert sorted(pan.requests) == [("tags", "dg1", None), ("tags", "dg2", None)]
+    assert full_tags == {
+        "t0": {"@name": "t0", "@loc": "dg1", "color": "dg1-color0"},
+        "t1": {"@name": "t1", "@loc": "dg1", "color": "dg1-color1"},
+        "t2": {"@name": "t2", "@loc": "dg2", "color": "dg2-color2"},
+    }
+
+    assert await utils.get_full_tags(tags={"dg-broken": ["t0"]}, pan=pan) == {}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_run():
+    schedule = Scheduler()
+    schedule.add(("create", "addresses", "a1"))
+    schedule.add(("create", "addresses", "bad"))
+    schedule.add(("create", "groups", "g1"), after=[("create", "addresses", "a1")])
+    schedule.add(("create", "groups", "g2"), after=[("create", "addresses", "bad")])
+    schedule.add(("create", "groups", "g3"), after=[("create", "groups", "g2")])
+    schedule.add(("create", "groups", "g4"), after=[("create", "addresses", "gone")])
+
+    batches = []
+
+    async def run_batch(group, items):
+        batches.append([key[-1] for key, _ in items])
+        await asyncio.sleep(0)
+        return [key[-1] != "bad" for key, _ in items]
+
+    results = await schedule.run(run_batch, batch_size=10)
+
+    assert results == {
+        ("create", "addresses", "a1"): True,
+        ("create", "addresses", "bad"): False,
+        ("create", "groups", "g1"): True,
+        ("create", "groups", "g2"): False,
+        ("create", "groups", "g3"): False,
+        ("create", "groups", "g4"): True,
+    }
+    # g4 doesn't wait for anything, g1 goes as soon as a1 is done
+    assert batches == [["a1", "bad"], ["g4"], ["g1"]]
+
+
 if __name__ == "__main__":
     # test_bunch_commands()
     test_check_sec_rules()
@@ -1,7 +1,15 @@
+import asyncio
 import os
+from urllib.parse import parse_qs
 
+import httpx
 import pytest
+from lxml import etree
 
+import pan_deduper.utils as utils
+from pan_deduper.cache import MISS, ResponseCache, SnapshotCache
+from pan_deduper.mock_panorama import MockPanorama
+from pan_deduper.panorama_api import AdaptiveLimiter
 from pan_deduper.panorama_api import PanoramaApi as pa_api
 
 
@@ -129,5 +137,384 @@ def test_deletes():
     assert output == correct_set_commands_delete
 
 
+def test_object_element():
+    obj = {
+        "@name": "grp2",
+        "@loc": "dg1",
+        "@location": "device-group",
+        "static": {"member": ["member1", "member 3"]},
+    }
+    element = pa_api.object_element(obj)
+    assert etree.tostring(element) == (
+        b'<entry name="grp2"><static><member>member1</member>'
+        b"<member>member 3</member></static></entry>"
+    )
+    assert pa_api.object_xpath("address-groups", "dg1", name="grp2") == (
+        "/config/devices/entry[@name='localhost.localdomain']/device-group"
+        "/entry[@name='dg1']/address-group/entry[@name='grp2']"
+    )
+    assert pa_api.object_xpath("tags", "shared") == "/config/shared/tag"
+
+
+def test_object_xpath_quoting():
+    xpath = pa_api.object_xpath("addresses", "it's dg", name="bob's")
+    assert xpath.endswith("""/entry[@name="it's dg"]/address/entry[@name="bob's"]""")
+    config = etree.fromstring(
+        "<config><devices><entry name='localhost.localdomain'><device-group>"
+        "<entry name=\"it's dg\"><address><entry name=\"bob's\"/><entry name='bob'/>"
+        "</address></entry></device-group></entry></devices></config>"
+    )
+    assert [e.get("name") for e in config.getroottree().xpath(xpath)] == ["bob's"]
+
+    with pytest.raises(ValueError):
+        pa_api.object_xpath("addresses", "dg1", name='bob\'s "addr"')
+
+
+@pytest.mark.asyncio
+async def test_delete_objects_unquotable_name():
+    sent = []
+
+    def handler(request):
+        params = parse_qs(request.content.decode())
+        sent.append(params["element"][0])
+        return httpx.Response(200, text='<response status="success"/>')
+
+    pa = api_with_handler(handler)
+    report = await pa.delete_objects(
+        deletes=[("addresses", "dg1", "a'b\"c"), ("addresses", "dg1", "addr1")],
+        batch_size=10,
+    )
+    assert report == [
+        ("addresses", "a'b\"c", "dg1", False),
+        ("addresses", "addr1", "dg1", True),
+    ]
+    assert len(sent) == 1 and "a'b" not in sent[0]
+
+
+def api_with_handler(handler):
+    pa = pa_api(panorama="panorama.test", username="admin", password="admin")
+    pa.apikey = "key"
+    pa.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return pa
+
+
+@pytest.mark.asyncio
+async def test_create_objects_batched():
+    requests = []
+
+    def handler(request):
+        params = parse_qs(request.content.decode())
+        requests.append(params)
+        if params["action"] == ["get"]:
+            return httpx.Response(
+                200, text='<response status="success"><result/></response>'
+            )
+        if params["action"] == ["multi-config"]:
+            element = etree.fromstring(params["element"][0])
+            bad = element.find("set/entry[@name='bad']")
+            if bad is not None:
+                return httpx.Response(
+                    200,
+                    text='<response status="error"><msg>rolled back</msg></response>',
+                )
+            return httpx.Response(200, text='<response status="success"/>')
+        if "bad" in params["element"][0]:
+            return httpx.Response(
+                200,
+                text='<response status="error"><msg><line>Invalid Object</line></msg></response>',
+            )
+        return httpx.Response(200, text='<response status="success"/>')
+
+    pa = api_with_handler(handler)
+    objs = [{"@name": f"addr{i}", "ip-netmask": f"10.0.0.{i}"} for i in range(5)]
+    objs.append({"@name": "bad", "ip-netmask": "nope"})
+
+    report = await pa.create_objects(
+        object_type="addresses",
+        objs=objs,
+        device_group=["All-Devices"],
+        batch_size=3,
+    )
+
+    multi = [r for r in requests if r["action"] == ["multi-config"]]
+    assert len(multi) == 2
+    # Existence check, then the 2nd batch failed, so its 3 entries were sent one at a time
+    assert len(requests) == 6
+    assert report[:5] == [(f"addr{i}", "All-Devices", True) for i in range(5)]
+    assert report[5] == ("bad", "All-Devices", False)
+
+    # More batches (as the scheduler sends them) don't pull the existing names again
+    requests.clear()
+    objs = [{"@name": "addr0", "ip-netmask": "10.0.0.0"}]
+    objs.append({"@name": "addr9", "ip-netmask": "10.0.0.9"})
+    report = await pa.create_objects(
+        object_type="addresses",
+        objs=objs,
+        device_group=["All-Devices"],
+        batch_size=3,
+    )
+    assert [r["action"] for r in requests] == [["multi-config"]]
+    assert report == [("addr0", "All-Devices", False), ("addr9", "All-Devices", True)]
+    await pa.delete_objects([("addresses", "All-Devices", "addr9")], batch_size=3)
+    assert "addr9" not in await pa.existing_names("addresses", "All-Devices")
+
+
+@pytest.mark.asyncio
+async def test_delete_objects_batched():
+    sent = []
+
+    def handler(request):
+        params = parse_qs(request.content.decode())
+        element = etree.fromstring(params["element"][0])
+        sent.append([delete.get("xpath") for delete in element.iterfind("delete")])
+        return httpx.Response(200, text='<response status="success"/>')
+
+    pa = api_with_handler(handler)
+    deletes = [
+        ("address-groups", "dg1", "grp1"),
+        ("address-groups", "dg2", "grp1"),
+        ("addresses", "dg1", "addr1"),
+        ("addresses", "dg1", "addr2"),
+        ("addresses", "shared", "addr1"),
+    ]
+    report = await pa.delete_objects(deletes=deletes, batch_size=2)
+
+    assert len(sent) == 4  # dg1 needs 2 batches, dg2 and shared 1 each
+    dg1 = [xpaths for xpaths in sent if "'dg1'" in xpaths[0]]
+    assert dg1[0][0].endswith("address-group/entry[@name='grp1']")
+    assert dg1[1][0].endswith("address/entry[@name='addr2']")
+    assert ["/config/shared/address/entry[@name='addr1']"] in sent
+    assert ("addresses", "addr1", "shared", True) in report
+    assert len(report) == 5
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter():
+    limiter = AdaptiveLimiter(maximum=8)
+    assert limiter.limit == 8
+
+    await limiter.acquire()
+    await limiter.release(healthy=False)
+    assert limiter.limit == 4
+    for _ in range(50):
+        await limiter.acquire()
+        await limiter.release(healthy=True)
+    assert limiter.limit == 8
+
+    # Every request in flight failing is one congestion event, one cut
+    epochs = [await limiter.acquire() for _ in range(6)]
+    for epoch in epochs:
+        await limiter.release(healthy=False, epoch=epoch)
+    assert limiter.limit == 4
+
+    # Next failure (sent after the last cut) is a new event
+    epoch = await limiter.acquire()
+    await limiter.release(healthy=False, epoch=epoch)
+    assert limiter.limit == 2
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_slow_responses():
+    # Small requests first, then big (slow) ones from a healthy Panorama
+    async def handler(request):
+        await asyncio.sleep(0.001 if "small" in request.url.path else 0.03)
+        return httpx.Response(200, json={"@status": "success"})
+
+    pa = api_with_handler(handler)
+    for _ in range(5):
+        await pa.get_request(url="small")
+    await asyncio.gather(*(pa.get_request(url="big") for _ in range(20)))
+    assert pa.limiter.limit == pa.limiter.maximum
+
+
+@pytest.mark.asyncio
+async def test_request_retries(monkeypatch):
+    async def no_sleep(_):
+        pass
+
+    monkeypatch.setattr(asyncio, "sleep", no_sleep)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectTimeout("timed out", request=request)
+        if len(calls) == 2:
+            return httpx.Response(
+                200, json={"@status": "error", "message": "Internal Error"}
+            )
+        return httpx.Response(200, json={"@status": "success", "@code": "20"})
+
+    pa = api_with_handler(handler)
+    response = await pa.post_request(url="Objects/Addresses", data={})
+    assert response == {"@status": "success", "@code": "20"}
+    assert len(calls) == 3
+    assert pa.limiter.in_flight == 0
+
+    # Writes give up (instead of exiting) once retries run out
+    calls.clear()
+    pa.retries = 1
+    response = await pa.delete_request(url="Objects/Addresses")
+    assert response == {"@status": "error", "message": "Internal Error"}
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_client_lifecycle():
+    async with pa_api(
+        panorama="panorama.test", username="a", password="b", max_concurrent=7
+    ) as pa:
+        client = pa.client
+        assert client is not None
+        assert pa.open() is client  # Reused, not recreated
+        assert client.headers["Accept-Encoding"] == "gzip"
+    assert pa.client is None
+    assert client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_response_cache(tmp_path):
+    commit_id = 10
+    gets = []
+
+    def handler(request):
+        if request.method == "GET":
+            gets.append(request)
+            entry = [{"@name": "addr1", "ip-netmask": "10.0.0.1"}]
+            return httpx.Response(200, json={"result": {"@count": "1", "entry": entry}})
+        cmd = parse_qs(request.content.decode()).get("cmd", [""])[0]
+        if not cmd:
+            return httpx.Response(200, json={"@status": "success"})
+        if "pending-changes" in cmd:
+            return httpx.Response(200, text="<response><result>no</result></response>")
+        jobs = (
+            f"<job><id>{commit_id}</id><type>CommitAll</type></job>"
+            "<job><id>99</id><type>Export</type></job>"
+        )
+        return httpx.Response(200, text=f"<response><result>{jobs}</result></response>")
+
+    async def run():
+        pa = api_with_handler(handler)
+        pa.cache_dir = str(tmp_path)
+        await pa.enable_cache()
+        objs = await pa.get_objects(object_type="addresses", device_group="dg1")
+        assert objs[0]["@name"] == "addr1"
+        return pa
+
+    await run()
+    await run()
+    assert len(gets) == 1  # 2nd run came from the cache
+    assert os.listdir(tmp_path / "responses" / "panorama.test") == ["commit-10"]
+
+    commit_id = 11
+    pa = await run()
+    assert len(gets) == 2  # New commit, stale cache is gone
+    assert os.listdir(tmp_path / "responses" / "panorama.test") == ["commit-11"]
+
+    await pa.post_request(url="Objects/Addresses", data={})
+    assert pa.cache is None  # Changing the config stops the cache
+
+
+def test_response_cache_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path), "panorama", "v1", max_mb=1)
+    cache.set(("old",), "x" * 600_000)
+    os.utime(cache._filename(("old",)), (0, 0))
+    cache.set(("new",), "y" * 600_000)
+    assert cache.get(("old",)) is MISS
+    assert cache.get(("new",)) == "y" * 600_000
+    assert cache.size <= cache.max_bytes
+
+    # Snapshots have their own directory and budget, neither evicts the other
+    snapshots = SnapshotCache(str(tmp_path), max_mb=1, max_age_days=7)
+    snapshots.set("digest", "names", "z" * 900_000)
+    assert cache.get(("new",)) == "y" * 600_000
+    cache.set(("newer",), "w" * 300_000)
+    assert snapshots.get("digest", "names") == "z" * 900_000
+
+
+@pytest.mark.asyncio
+async def test_mock_panorama(monkeypatch):
+    async def no_sleep(_):
+        pass
+
+    monkeypatch.setattr(asyncio, "sleep", no_sleep)
+    mock = MockPanorama(device_groups=3, objects=10, error_rate=0.2, seed=1)
+    async with pa_api(
+        panorama="mock", username="admin", password="admin", transport=mock
+    ) as pa:
+        await pa.login()
+        device_groups = await pa.get_device_groups()
+        assert device_groups == ["dg-0000", "dg-0001", "dg-0002"]
+
+        fetched = await asyncio.gather(
+            *[
+                pa.get_objects(object_type="addresses", device_group=dg)
+                for dg in device_groups
+            ]
+        )
+        names = [{obj["@name"] for obj in objs} for objs in fetched]
+        assert len(set.intersection(*names)) == 5  # duplicate_ratio=0.5
+        assert mock.stats["errors"] > 0  # Injected errors were retried
+
+        assert list(await pa.get_parent_dgs()) == device_groups
+        config = await pa.get_config()
+        assert len(config.findall("devices/entry/device-group/entry")) == 3
+
+        report = await pa.delete_objects(
+            deletes=[("addresses", "dg-0000", "addr-0")], batch_size=10
+        )
+        assert report == [("addresses", "addr-0", "dg-0000", True)]
+
+
+@pytest.mark.asyncio
+async def test_mock_panorama_rules():
+    # 4 rules over 2 addresses/services: rule 0 (deny) covers rule 2, rule 1 is
+    # the same as rule 3
+    mock = MockPanorama(device_groups=1, objects=2, rules=4)
+    async with pa_api(
+        panorama="mock", username="admin", password="admin", transport=mock
+    ) as pa:
+        await pa.login()
+        rules = await pa.get_objects(object_type="secrules-pre", device_group="dg-0000")
+
+    assert all(rule["@loc"] == "dg-0000" for rule in rules)
+    updates = utils.check_sec_rules(rules)
+    assert updates["pre-rule-1"]["rules"] == [rules[3]]
+    shadowed = utils.find_shadowed_rules(rules)
+    assert [(rule["@name"], by["@name"]) for rule, by in shadowed] == [
+        ("pre-rule-2", "pre-rule-0"),
+        ("pre-rule-3", "pre-rule-1"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_create_objects_existing():
+    mock = MockPanorama(device_groups=2, objects=4)
+    async with pa_api(
+        panorama="mock", username="admin", password="admin", transport=mock
+    ) as pa:
+        await pa.login()
+        # addr-0 is already in dg-0000, a 'set' would overwrite its value
+        objs = [
+            {"@name": "addr-0", "ip-netmask": "192.0.2.1/32"},
+            {"@name": "addr-new", "ip-netmask": "192.0.2.2/32"},
+        ]
+        report = await pa.create_objects(
+            object_type="addresses", objs=objs, device_group=["dg-0000"], batch_size=10
+        )
+        assert report == [("addr-0", "dg-0000", False), ("addr-new", "dg-0000", True)]
+        assert mock.stats["entries_changed"] == 1
+
+        report = await pa.create_objects(
+            object_type="tags",
+            objs=[{"@name": "tag-0", "color": "color9"}],
+            device_group=["dg-0000"],
+            batch_size=10,
+            skip_existing=True,
+        )
+        assert report == [("tag-0", "dg-0000", True)]
+        assert mock.stats["entries_changed"] == 1
+
+
 if __name__ == "__main__":
     test_creates()
@@ -1,7 +1,11 @@
-import sys
+import bz2
+import gzip
+import io
+import lzma
+import tarfile
 
 import pytest
-from lxml.etree import XMLSyntaxError
+from lxml import etree
 
 import pan_deduper.utils as utils
 
@@ -36,3 +40,239 @@ async def test_empty_xml(capsys, monkeypatch):
     monkeypatch.setattr("builtins.input", lambda _: "Yes")
     objs = await utils.get_objects_xml(empty_xml)
     assert isinstance(objs, dict)
+
+
+test_config = """
+<config>
+  <shared>
+    <address>
+      <entry name="addr1"><ip-netmask>1.1.1.1/32</ip-netmask></entry>
+    </address>
+  </shared>
+  <devices>
+    <entry name="localhost.localdomain">
+      <device-group>
+        <entry name="dg1">
+          <address>
+            <entry name="addr1"><ip-netmask>1.1.1.1/32</ip-netmask></entry>
+            <entry name="addr2"><fqdn>a.example.com</fqdn></entry>
+          </address>
+          <address-group>
+            <entry name="grp1"><static><member>addr1</member></static></entry>
+          </address-group>
+          <pre-rulebase>
+            <security>
+              <rules>
+                <entry name="rule1"><action>allow</action></entry>
+              </rules>
+            </security>
+          </pre-rulebase>
+        </entry>
+        <entry name="dg2">
+          <address>
+            <entry name="addr1"><ip-netmask>1.1.1.1/32</ip-netmask></entry>
+          </address>
+          <address-group>
+            <entry name="grp1">
+              <static><member>addr1</member><member>addr2</member></static>
+            </entry>
+          </address-group>
+        </entry>
+      </device-group>
+    </entry>
+  </devices>
+</config>
+"""
+
+
+@pytest.mark.asyncio
+async def test_get_objects_config(dedupe_settings):
+    dedupe_settings.TO_DEDUPE = ["addresses", "address-groups"]
+    config = etree.fromstring(test_config)
+
+    objs = await utils.get_objects_config(config)
+    assert objs["addresses"] == {"dg1": {"addr1", "addr2"}, "dg2": {"addr1"}}
+
+    full = utils.get_full_objects_config(
+        config, device_groups=["dg2"], object_types=["address-groups"]
+    )
+    assert full["address-groups"]["dg2"] == [
+        {"@name": "grp1", "static": {"member": ["addr1", "addr2"]}}
+    ]
+
+    shared = utils.get_names_config(config, ["shared"], ["addresses"])
+    assert shared == {"addresses": {"shared": {"addr1"}}}
+
+    locations = utils.index_config(config)
+    assert list(locations) == ["dg1", "dg2", "shared"]
+    rules = utils.location_entries(locations["dg1"], "secrules-pre")
+    assert [rule.get("name") for rule in rules] == ["rule1"]
+    assert utils.location_entries(locations.get("nope"), "addresses") == []
+
+
+@pytest.mark.asyncio
+async def test_stream_objects_xml(dedupe_settings, tmp_path):
+    dedupe_settings.TO_DEDUPE = ["addresses", "address-groups"]
+    filename = tmp_path / "config.xml"
+    filename.write_text(test_config)
+
+    objs = await utils.stream_objects_xml(str(filename))
+    assert objs["addresses"] == {"dg1": {"addr1", "addr2"}, "dg2": {"addr1"}}
+    assert dedupe_settings.DEVICE_GROUPS == ["dg1", "dg2"]
+
+    with open(filename, "rb") as f:
+        objs = await utils.stream_objects_xml(f, deep=True)
+    assert objs["address-groups"]["dg2"] == [
+        {"@name": "grp1", "static": {"member": ["addr1", "addr2"]}}
+    ]
+
+    # Device groups are dropped once we've moved past them
+    seen = []
+    for name, dg in utils.iter_device_groups(str(filename)):
+        assert len(dg) in (2, 3)
+        seen.append(dg)
+    assert [len(dg) for dg in seen] == [0, 0]
+
+
+@pytest.mark.parametrize("compression", ["gz", "bz2", "xz", "tgz", "tar"])
+def test_open_config(compression, tmp_path):
+    data = test_config.encode()
+    filename = tmp_path / f"config.{compression}"
+    if compression == "gz":
+        filename.write_bytes(gzip.compress(data))
+    elif compression == "bz2":
+        filename.write_bytes(bz2.compress(data))
+    elif compression == "xz":
+        filename.write_bytes(lzma.compress(data))
+    else:
+        mode = "w:gz" if compression == "tgz" else "w"
+        with tarfile.open(filename, mode) as tar:
+            for name, content in (
+                ("./device-state/readme.xml", b"<nope/>"),
+                ("./device-state/running-config.xml", data),
+            ):
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+
+    with utils.open_config(str(filename)) as f:
+        assert [name for name, _ in utils.iter_device_groups(f)] == ["dg1", "dg2"]
+
+
+@pytest.mark.asyncio
+async def test_get_objects_file_snapshot(dedupe_settings, monkeypatch, tmp_path):
+    dedupe_settings.SNAPSHOT_CACHE = True
+    filename = tmp_path / "config.xml"
+    filename.write_text(test_config)
+
+    objs = await utils.get_objects_file(str(filename))
+    assert objs["addresses"] == {"dg1": {"addr1", "addr2"}, "dg2": {"addr1"}}
+
+    # 2nd run (with different settings) comes from the snapshot, no parsing
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("config was parsed again")
+
+    monkeypatch.setattr(utils, "iter_device_groups", no_parsing)
+    dedupe_settings.DEVICE_GROUPS = []
+    dedupe_settings.EXCLUDE_DEVICE_GROUPS = ["dg2"]
+    dedupe_settings.TO_DEDUPE = ["address-groups"]
+    objs = await utils.get_objects_file(str(filename))
+    assert objs == {"address-groups": {"dg1": {"grp1"}}}
+
+    # Changed file, new snapshot
+    filename.write_text(test_config.replace("addr2", "addr3"))
+    with pytest.raises(AssertionError):
+        await utils.get_objects_file(str(filename))
+
+
+@pytest.mark.asyncio
+async def test_get_objects_file_no_snapshot(dedupe_settings, monkeypatch, tmp_path):
+    dedupe_settings.EXCLUDE_DEVICE_GROUPS = ["dg2"]
+    filename = tmp_path / "config.xml"
+    filename.write_text(test_config)
+
+    def no_hashing(*args, **kwargs):
+        raise AssertionError("file was hashed")
+
+    extracted = []
+    extract_objects_xml = utils.extract_objects_xml
+
+    def spy(source, deep, object_types, wanted=None):
+        found_dgs, found = extract_objects_xml(source, deep, object_types, wanted)
+        extracted.append(found)
+        return found_dgs, found
+
+    monkeypatch.setattr(utils, "file_digest", no_hashing)
+    monkeypatch.setattr(utils, "extract_objects_xml", spy)
+
+    objs = await utils.get_objects_file(str(filename))
+    assert objs == {"addresses": {"dg1": {"addr1", "addr2"}}}
+    # Only what settings.py asks for was collected
+    assert extracted == [{"addresses": {"dg1": {"addr1", "addr2"}}}]
+    assert not (tmp_path / "cache").exists()
+
+
+sec_rules_config = """
+<config>
+  <devices>
+    <entry name="localhost.localdomain">
+      <device-group>
+        <entry name="dg1">
+          <pre-rulebase>
+            <security>
+              <rules>
+                %s
+              </rules>
+            </security>
+          </pre-rulebase>
+        </entry>
+      </device-group>
+    </entry>
+  </devices>
+</config>
+""" % "".join(
+    f"""
+    <entry name="rule{i}" uuid="{i}">
+      <from><member>inside</member></from>
+      <to><member>outside</member></to>
+      <source><member>{i}.{i}.{i}.{i}/32</member></source>
+      <destination><member>9.9.9.9/32</member></destination>
+      <service><member>application-default</member></service>
+      <application><member>ssl</member></application>
+      <action>allow</action>
+    </entry>"""
+    for i in (1, 2)
+)
+
+
+@pytest.mark.asyncio
+async def test_secduper_xml(dedupe_settings, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    filename = tmp_path / "config.xml"
+    filename.write_text(sec_rules_config)
+
+    rules = utils.get_sec_rules_xml(str(filename))
+    assert rules["dg1"]["post"] is None
+    rule1 = rules["dg1"]["pre"][0]
+    assert rule1["@name"] == "rule1"
+    assert rule1["@loc"] == rule1["@device-group"] == "dg1"
+    assert rule1["source"] == {"member": ["1.1.1.1/32"]}
+
+    await utils.run_secduper(configfile=str(filename))
+    output = (tmp_path / "set-commands-sec_rules-dg1.txt").read_text()
+    assert "security rules 'rule1' source 2.2.2.2/32" in output
+    assert "delete device-group dg1 pre-rulebase security rules 'rule2'" in output
+
+
+def test_write_sec_rules_output_parallel(dedupe_settings, monkeypatch, tmp_path):
+    dedupe_settings.WORKERS = 2
+    monkeypatch.chdir(tmp_path)
+    dg = etree.fromstring(sec_rules_config).find(".//device-group/entry")
+    rules = [utils.rule_to_dict(entry, "dg1") for entry in dg.iterfind(".//entry")]
+    my_rules = {f"dg{i}": {"pre": rules, "post": None} for i in range(4)}
+
+    utils.write_sec_rules_output(my_rules)
+    for i in range(4):
+        output = (tmp_path / f"set-commands-sec_rules-dg{i}.txt").read_text()
+        assert "delete device-group dg1 pre-rulebase security rules 'rule2'" in output
+        assert (tmp_path / f"shadowed-rules-dg{i}.txt").exists()